@@ -8,11 +8,10 @@ and your sessions played.
 """
 
 # TODO: Color
-# TODO: Implement salakieli actions
 
 import argparse
+import contextlib
 import datetime
-import glob
 import itertools
 import logging
 import os
@@ -24,6 +23,8 @@ import utility.detail
 from utility.detail import Detail, DETAIL
 import utility.loghelper
 from utility.loghelper import LEVEL_CODES
+import utility.report
+import utility.watch
 utility.loghelper.tracelog.hotpatch(logging)
 
 # pylint: disable=wrong-import-position
@@ -90,33 +91,55 @@ def get_saves(saves_path, for_save=None):
   return save_dirs
 
 def get_sessions(save_path):
-  "Get all of the play sessions within a given save directory"
-  stats_path = os.path.join(save_path, "stats", "sessions")
-  for stats_file in glob.glob(os.path.join(stats_path, "*_stats.xml")):
+  """
+  Get all of the play sessions within a given save directory
+
+  Sessions are SessionRef objects; their files are parsed only when
+  something other than their date is needed.
+  """
+  for stats_file in noitalib.get_stats_files(save_path):
     logger.trace("Found session %r", stats_file)
-    yield noitalib.parse_session(stats_file)
+    yield noitalib.SessionRef(stats_file)
 
 def get_kills_file(stats_file):
   "Get the kills.xml file from the given stats.xml file"
   return stats_file.replace("stats.xml", "kills.xml")
 
-def filter_sessions(sessions, filter_term):
-  "Return a list of sessions matching the filter term"
+def filter_sessions(sessions, filter_term, workers=None):
+  """
+  Return a list of sessions matching the filter term
+
+  A session matches if its filename starts with the term or if its seed
+  equals the term, as with SessionIndex.sessions(). A YYYYMMDD term that
+  matches any filename is taken to be a date and is not compared against
+  seeds.
+
+  Only comparing seeds requires parsing the sessions, which is done using
+  up to workers processes. Other all-digit terms, including a YYYYMMDD
+  date that matches no filename, parse every session whose filename
+  doesn't match; use --session-index to avoid that cost.
+  """
   sessions = sorted(sessions, key=lambda sess: sess["date"])
   if sessions:
     if filter_term == "last":
       yield sessions[-1]
     elif filter_term == "today":
       filter_term = format_today(noitalib.SESS_DATE_FORMAT)
-      yield from filter_sessions(sessions, filter_term)
+      yield from filter_sessions(sessions, filter_term, workers)
+    elif not filter_term:
+      yield from sessions
     else:
-      for session in sessions:
-        sfile = session["_files"]["stats_file"]
-        if not filter_term:
-          yield session
-        elif os.path.basename(sfile).startswith(filter_term):
-          yield session
-        elif session["seed"] == filter_term:
+      named = [os.path.basename(session["_files"]["stats_file"])
+          .startswith(filter_term) for session in sessions]
+      # Seeds are numeric, so other terms can only match the filename, and
+      # a date that matches a filename is not a seed
+      by_seed = filter_term.isdigit() and not (
+          any(named) and noitalib.is_date_term(filter_term))
+      if by_seed:
+        noitalib.load_sessions([session
+          for session, match in zip(sessions, named) if not match], workers)
+      for session, match in zip(sessions, named):
+        if match or (by_seed and session["seed"] == filter_term):
           yield session
 
 def world_get_orbs(save_dir, wstate, langmap):
@@ -143,19 +166,108 @@ def world_get_orbs(save_dir, wstate, langmap):
     "orb_map": orb_map
   }
 
+def world_get_seed(save_dir, wstate):
+  "Determine the world's seed from its session; None if unknown"
+  try:
+    return wstate.get_session_stats(save_dir)["seed"]
+  except FileNotFoundError:
+    logger.warning("World %s session file not found", wstate.path)
+  return None
+
+# ----------------------------------------------------------------------
+# Public record functions for --format=json and --format=ndjson
+
+def session_record(save_dir, session):
+  "Build a record describing a session"
+  record = {
+    "save": os.path.basename(save_dir),
+    "stats_file": session["_files"]["stats_file"]
+  }
+  for key in noitalib.sessions.SESSION_KEYS:
+    if not key.startswith("_"):
+      record[key] = session[key]
+  return record
+
+def world_record(save_dir, wstate, langmap, detail=Detail.BASIC):
+  "Build a record describing a WorldState"
+  orb_info = world_get_orbs(save_dir, wstate, langmap)
+  record = {
+    "save": os.path.basename(save_dir),
+    "path": wstate.path,
+    "seed": world_get_seed(save_dir, wstate),
+    "orbs": sorted(orb_info["orbs_have"]),
+    "orbs_need": sorted(orb_info["orbs_need"]),
+    "orb_map": orb_info["orb_map"],
+    "shifts": list(wstate.shifts()),
+    "fungal_shifts": wstate.fungal_shifts(),
+    "perks": dict(wstate.perks()),
+    "reroll_info": wstate.reroll_info()
+  }
+  if detail >= Detail.MORE:
+    record["lua_globals"] = wstate.lua_globals()
+    record["flags"] = wstate.flags()
+  return record
+
+def player_record(save, player, langmap, detail=Detail.BASIC):
+  "Build a record describing a Player"
+  items = []
+  for item_def in player.items:
+    kind, name, desc = item_def[:3]
+    item = {"kind": kind, "name": name, "description": desc}
+    if len(item_def) > 3:
+      item["contents"] = item_def[3]
+    items.append(item)
+  return {
+    "save": save,
+    "position": player.pos(),
+    "health": player.health,
+    "max_health": player.max_health,
+    "blood_material": player.blood_material,
+    "blood_spray_material": player.blood_spray_material,
+    "material_damages": player.material_damages,
+    "damage_multipliers": player.damage_multipliers,
+    "ingestions": player.ingestions(),
+    "drug_effects": {key: value
+      for key, value in player.drug_effects.items() if key != "_enabled"},
+    "status_effects": player.status_effects(),
+    "items": items
+  }
+
+def language_map_records(langmap, mode, lang_override):
+  "Yield a record for each token in the language map; see --dump-i18n"
+  for token in sorted(langmap):
+    if mode == LM_DUMP_BRIEF:
+      yield {"token": token}
+    elif mode == LM_DUMP_VALUE:
+      yield {"token": token, "value": langmap.get(token, language=lang_override)}
+    elif mode == LM_DUMP_VALUES:
+      yield {"token": token,
+          "translations": langmap.get_token(token).translations}
+    elif mode == LM_DUMP_FULL:
+      ttoken = langmap.get_token(token)
+      yield {"token": token,
+          "translations": ttoken.translations,
+          "notes": ttoken.notes}
+
 # ----------------------------------------------------------------------
 # Public print functions
 
-def print_language_map(langmap, mode, lang_override):
-  "Dump the language map"
+def get_language_map_mode(mode, lang_override):
+  "Determine the --dump-i18n mode; returns None if the mode is invalid"
   if mode is None:
     if lang_override is None:
-      mode = LM_DUMP_BRIEF
-    else:
-      mode = LM_DUMP_VALUE
-  elif mode not in LM_DUMPS:
+      return LM_DUMP_BRIEF
+    return LM_DUMP_VALUE
+  if mode not in LM_DUMPS:
     logger.error("Invalid langmap dump mode %r", mode)
     logger.info("Choices are: %s", LM_DUMPS)
+    return None
+  return mode
+
+def print_language_map(langmap, mode, lang_override):
+  "Dump the language map"
+  mode = get_language_map_mode(mode, lang_override)
+  if mode is None:
     return
 
   for token in sorted(langmap):
@@ -173,6 +285,13 @@ def print_language_map(langmap, mode, lang_override):
       notes = ttoken.notes
       print(f"{token} values={values!r} notes={notes!r}")
 
+def print_table(rows):
+  "Print rows of strings as a table with aligned columns"
+  widths = [max(len(row[col]) for row in rows) for col in range(len(rows[0]))]
+  for row in rows:
+    print("  ".join(cell.ljust(width)
+      for cell, width in zip(row, widths)).rstrip())
+
 def print_session(save_dir, # TODO: configure detail level
     session,
     l10n,
@@ -190,7 +309,12 @@ def print_session(save_dir, # TODO: configure detail level
   logger.trace("Biomes visited: %r", session["visits"])
   logger.trace("Kills: %r", session["kills"])
   if show_stats:
-    for stat_name, stat_value in session["stats"].items():
+    # Display the stats as written, rather than as parsed
+    stats_text = session.get("stats_text")
+    if stats_text is None:
+      stats_text = {name: str(value)
+          for name, value in session["stats"].items()}
+    for stat_name, stat_value in stats_text.items():
       print(f"\t{stat_name} = {stat_value!r}")
   if show_items: # TODO
     pass
@@ -297,11 +421,8 @@ def print_world(save_dir, wstate, langmap, detail=Detail.BASIC):
   "Print a WorldState"
   save_name = os.path.basename(save_dir)
   num_orbs = Pl(len(wstate.orbs()), "orb")
-  try:
-    session = wstate.get_session_stats(save_dir)
-    seed = session["seed"]
-  except FileNotFoundError:
-    logger.warning("World %s session file not found")
+  seed = world_get_seed(save_dir, wstate)
+  if seed is None:
     seed = "<unknown>"
   print(f"{save_name} - {num_orbs} - Seed {seed}")
 
@@ -394,29 +515,79 @@ def configure_logging(ap, args):
       utility.loghelper.apply_level(logger_name, level_code)
 
   if args.list_loggers:
+    stream = _info_stream(args)
     for inst in get_loggers():
       wrapper = None
       if isinstance(inst, utility.loghelper.DelayLogger):
         if inst.initialized:
-          print("{}: delay; initialized".format(inst.name))
+          print("{}: delay; initialized".format(inst.name), file=stream)
         else:
-          print("{}: delay; not initialized".format(inst.name))
+          print("{}: delay; not initialized".format(inst.name), file=stream)
       else:
         level = logging.getLevelName(inst.getEffectiveLevel())
-        print("{}: core logger: {}".format(inst.name, level))
+        print("{}: core logger: {}".format(inst.name, level), file=stream)
 
 # ----------------------------------------------------------------------
 # Private functions implementing top-level arguments
 
-def _main_show_world(save_dirs, langmap, detail):
+def _info_stream(args):
+  """
+  Get the stream for informational output that isn't part of a report:
+  stdout for text output, or stderr so as not to corrupt --format records
+  """
+  if args.format == utility.report.FORMAT_TEXT:
+    return sys.stdout
+  return sys.stderr
+
+@contextlib.contextmanager
+def _open_output(args):
+  """
+  Send stdout through a buffered --output writer and yield the --format
+  writer, or None if the format is text
+  """
+  with utility.report.open_output(args.output, args.gzip) as stream:
+    with contextlib.redirect_stdout(stream):
+      if args.format == utility.report.FORMAT_TEXT:
+        yield None
+      else:
+        with utility.report.ReportWriter(stream, args.format) as report:
+          yield report
+
+def _report_world(report, save_dir, wstate, langmap, detail):
+  "Print or write a record describing the world"
+  if report is not None:
+    report.write("world", world_record(save_dir, wstate, langmap, detail))
+  else:
+    print_world(save_dir, wstate, langmap, detail)
+
+def _report_player(report, save, player, langmap, detail):
+  "Print or write a record describing the player"
+  if report is not None:
+    report.write("player", player_record(save, player, langmap, detail))
+  else:
+    print_player(save, player, langmap, detail)
+
+def _report_session(report, save_dir, session, langmap, args, detail):
+  "Print or write a record describing the session"
+  if report is not None:
+    report.write("session", session_record(save_dir, session))
+  else:
+    print_session(save_dir, session, langmap,
+        show_stats=args.show_stats,
+        show_items=args.show_items,
+        show_biomes=args.show_biomes,
+        show_kills=args.show_kills,
+        detail=detail)
+
+def _main_show_world(save_dirs, langmap, detail, report=None):
   "Print information about the world"
   for save_dir in save_dirs:
     wfile = noitalib.world.get_world_file(save_dir)
     if os.path.exists(wfile):
       wstate = noitalib.world.WorldState(wfile)
-      print_world(save_dir, wstate, langmap, detail)
+      _report_world(report, save_dir, wstate, langmap, detail)
 
-def _main_show_players(save_dirs, langmap, detail):
+def _main_show_players(save_dirs, langmap, detail, report=None):
   "Print information about the player(s)"
   players = {}
   for save_dir in save_dirs:
@@ -428,13 +599,16 @@ def _main_show_players(save_dirs, langmap, detail):
       logger.debug("In %s: %r", save_dir, player)
   logger.debug("Found %s", Pl(len(players), "player file"))
   for save, player in players.items():
-    print_player(save, player, langmap, detail)
+    _report_player(report, save, player, langmap, detail)
 
-def _main_list_mods(steam_path, appid, game_path, detail):
+def _main_list_mods(steam_path, appid, game_path, detail, report=None):
   "List both Steam and native mods"
   for mod_def in itertools.chain(
       noitalib.get_workshop_mods(steam_path, appid),
       noitalib.get_native_mods(game_path)):
+    if report is not None:
+      report.write("mod", mod_def)
+      continue
     mod_id = mod_def["id"]
     mod_wsid = mod_def["workshop_id"]
     prefix = []
@@ -450,6 +624,106 @@ def _main_list_mods(steam_path, appid, game_path, detail):
       pieces.append(mod_def["description"])
     print(" ".join(pieces))
 
+def _open_session_index(args):
+  "Open the --session-index database, if one was given"
+  if args.session_index:
+    return noitalib.sessionindex.SessionIndex(args.session_index)
+  return contextlib.nullcontext()
+
+def _select_sessions(save_dir, args, session_index):
+  "Get the parsed sessions in the save matching -s,--session"
+  if session_index is not None:
+    session_index.update(save_dir, args.jobs)
+    return list(session_index.sessions(save_dir, args.session))
+  sessions = list(filter_sessions(get_sessions(save_dir),
+    args.session, args.jobs))
+  noitalib.load_sessions(sessions, args.jobs)
+  return sessions
+
+def _main_list_sessions(save_dirs, langmap, args, detail, report=None):
+  "Print the sessions matching -s,--session, optionally using an index"
+  with _open_session_index(args) as session_index:
+    for save_dir in save_dirs:
+      sessions = _select_sessions(save_dir, args, session_index)
+      for session in sorted(sessions, key=lambda sess: sess["date"]):
+        _report_session(report, save_dir, session, langmap, args, detail)
+
+def _main_aggregate(save_dirs, args, detail, report=None):
+  "Print a summary of the sessions matching -s,--session"
+  with _open_session_index(args) as session_index:
+    for save_dir in save_dirs:
+      if session_index is not None and not args.session:
+        session_index.update(save_dir, args.jobs)
+        table = session_index.table(save_dir)
+      else:
+        table = noitalib.aggregate.SessionTable.from_sessions(
+            _select_sessions(save_dir, args, session_index))
+      if report is not None:
+        save_name = os.path.basename(save_dir)
+        for record in noitalib.aggregate.summary(table, args.aggregate):
+          report.write("aggregate", {"save": save_name, **record})
+        if detail >= Detail.MORE:
+          report.write("kills", {"save": save_name,
+            "kills": table.kill_totals()})
+        continue
+      print(f"{os.path.basename(save_dir)} - {Pl(len(table), 'session')}")
+      print_table(noitalib.aggregate.summarize(table, args.aggregate))
+      if detail >= Detail.MORE:
+        print("Kills:")
+        for enemy, count in table.kill_totals().items():
+          print(f"\t{enemy} = {count}")
+
+def _watch_report(report, save_dir, fpath, langmap, args, detail):
+  "Print whatever the change to the given file affects"
+  if fpath.endswith("_stats.xml"):
+    if os.path.isfile(fpath):
+      session = noitalib.Session.parse(fpath)
+      _report_session(report, save_dir, session, langmap, args, detail)
+  elif fpath == noitalib.world.get_world_file(save_dir) and args.show_world:
+    wstate = noitalib.world.WorldState(fpath)
+    _report_world(report, save_dir, wstate, langmap, detail)
+  elif fpath == noitalib.player.get_player_file(save_dir) and args.show_player:
+    player = noitalib.player.Player(fpath)
+    _report_player(report, os.path.basename(save_dir), player, langmap, detail)
+
+def _main_watch(save_dirs, langmap, args, detail, report=None):
+  "Print sessions, and the world and player if requested, as they change"
+  watch_dirs = {}
+  for save_dir in save_dirs:
+    watch_dirs[save_dir] = save_dir
+    sessions_path = noitalib.get_sessions_path(save_dir)
+    if os.path.isdir(sessions_path):
+      watch_dirs[sessions_path] = save_dir
+  with utility.watch.open_watcher(watch_dirs) as watcher:
+    logger.info("Watching %s; press Ctrl+C to stop",
+        Pl(len(save_dirs), "save"))
+    try:
+      while True:
+        changed = set()
+        for fpath in watcher.wait():
+          logger.debug("Changed: %s", fpath)
+          # A new kills.xml means its session must be printed again
+          changed.add(fpath.replace("_kills.xml", "_stats.xml"))
+        for fpath in sorted(changed):
+          save_dir = watch_dirs[os.path.dirname(fpath)]
+          try:
+            _watch_report(report, save_dir, fpath, langmap, args, detail)
+          except (OSError, ValueError, SyntaxError) as err:
+            logger.warning("Failed to read %s: %s", fpath, err)
+        sys.stdout.flush()
+    except KeyboardInterrupt:
+      pass
+
+def _main_convert_salakieli(save_dirs, encrypt, workers):
+  "Decrypt or re-encrypt every salakieli file in the given saves"
+  for save_dir in save_dirs:
+    if encrypt:
+      paths = salakieli.encrypt_tree(save_dir, workers)
+    else:
+      paths = salakieli.decrypt_tree(save_dir, workers)
+    verb = "Encrypted" if encrypt else "Decrypted"
+    logger.info("%s %s in %s", verb, Pl(len(paths), "file"), save_dir)
+
 def main():
   "Entry point"
   ap = argparse.ArgumentParser(epilog=textwrap.dedent(f"""
@@ -465,11 +739,35 @@ def main():
     YYYYMMDD to select all sessions played that day
     YYYYMMDD-HHMISS to select a specific session by start date and time
     Numeric world seed to select all sessions with that seed
+  Sessions are parsed only as needed: dates match by filename, but seeds
+  (and a YYYYMMDD date with no sessions) require parsing every session
+  unless --session-index is given.
     "today" to select sessions played today
     "last" to select the most recent session
 
+  --aggregate prints totals and averages per build, seed, date, month, year
+  or cause of death (killed_by) for the sessions selected by -s,--session.
+
+  --watch runs until interrupted, printing each session as it is written,
+  along with the world (-W) or player (-P) whenever those files change. It
+  uses inotify where available and polls for changes otherwise.
+
+  --session-index stores parsed sessions keyed by file path, modification
+  time and size, so later runs only parse new or changed session files.
+  --xml-cache does the same for the world state and mod files.
+
   --dump-i18n is equivalent to --dump-i18n=brief.
 
+  --format=ndjson writes one JSON object per line for each session, world,
+  player, save, mod, i18n token and aggregate group, with a "type" field
+  naming which. --format=json writes a single JSON array of those objects.
+
+  Output is buffered; -o,--output writes it to a file instead of stdout,
+  compressed with gzip if the file name ends with .gz or -z,--gzip is given.
+
+  --decrypt-all writes each X.salakieli file to X.salakieli.xml. After
+  editing or restoring those copies, --encrypt-all writes them back.
+
   For --level, valid log levels are "T", "D", "I", "W", "E", and "F" for TRACE,
   DEBUG, INFO, WARNING, ERROR, and FATAL respectively.
   """), formatter_class=argparse.RawDescriptionHelpFormatter)
@@ -505,14 +803,34 @@ def main():
       help="include session biomes visited")
   ag.add_argument("--show-kills", action="store_true",
       help="include session kills")
+  ag.add_argument("--aggregate", metavar="KEY", nargs="?", const="build",
+      choices=noitalib.aggregate.GROUP_KEYS,
+      help="summarize sessions grouped by %(metavar)s (default: %(const)s)")
+  ag.add_argument("--session-index", metavar="PATH",
+      help="cache parsed sessions in the SQLite database %(metavar)s")
+  ag.add_argument("--watch", action="store_true",
+      help="display sessions (and -W/-P output) as the game writes them")
   ag = ap.add_argument_group("current game information")
   ag.add_argument("-W", "--show-world", action="store_true",
       help="display information about the game world itself")
   ag.add_argument("-P", "--show-player", action="store_true",
       help="display information about the player")
-  ag = ap.add_argument_group("detail level")
+  ag = ap.add_argument_group("encrypted files")
+  mg = ag.add_mutually_exclusive_group()
+  mg.add_argument("--decrypt-all", action="store_true",
+      help="decrypt every salakieli file in the selected save(s)")
+  mg.add_argument("--encrypt-all", action="store_true",
+      help="re-encrypt every decrypted salakieli file in the selected save(s)")
+  ag = ap.add_argument_group("detail level and output format")
   ag.add_argument("-d", "--detail", choices=DETAIL, default=Detail.NORMAL.name,
       help="configure detail level for above actions (default: %(default)s)")
+  ag.add_argument("--format", choices=utility.report.FORMATS,
+      default=utility.report.FORMAT_TEXT,
+      help="output format for above actions (default: %(default)s)")
+  ag.add_argument("-o", "--output", metavar="PATH",
+      help="write output to %(metavar)s instead of stdout")
+  ag.add_argument("-z", "--gzip", action="store_true", default=None,
+      help="compress output with gzip (default: if --output ends with .gz)")
   ag = ap.add_argument_group("internationalization")
   ag.add_argument("--dump-i18n", nargs="?", default=UNSET, choices=LM_DUMPS,
       help="output the i18n mapping")
@@ -538,19 +856,25 @@ def main():
   mg.add_argument("-q", "--quiet", action="store_true",
       help="disable all diagnostics below critical")
 
+  ap.add_argument("-j", "--jobs", type=int, metavar="NUM",
+      help="number of files to process in parallel (default: all cores)")
+  ap.add_argument("--xml-cache", metavar="PATH",
+      help="cache data extracted from XML files in the directory %(metavar)s")
   ap.add_argument("--help-detail", action="store_true",
       help="show detailed usage for -d,--detail argument")
   args = ap.parse_args()
 
   # Process actions that lead to an early exit
   if args.help_detail:
-    print("The -d,--detail argument accepts the following values:")
+    stream = _info_stream(args)
+    print("The -d,--detail argument accepts the following values:",
+        file=stream)
     value_map = cfuncs.aggregate_values_dict({
       det: val.value for det, val in DETAIL.items()})
     for dvalue, dnames in value_map.items():
       dnames_str = ", ".join(dnames).ljust(len("NORMAL, N"))
       dhelp = utility.detail.detail_help(dnames[0])
-      print(f"\t{dnames_str} = {dvalue}: {dhelp}")
+      print(f"\t{dnames_str} = {dvalue}: {dhelp}", file=stream)
     ap.exit()
 
   detail = DETAIL[args.detail]
@@ -561,10 +885,15 @@ def main():
       ap.error("--localize cannot be used with --no-i18n")
     if args.dump_i18n != UNSET:
       ap.error("--dump-i18n cannot be used with --no-i18n")
+  if (args.decrypt_all or args.encrypt_all) and not HAVE_SALAKIELI:
+    ap.error("salakieli support is disabled; see the error above")
 
   # Configure all of the loggers to have the desired level, if given
   configure_logging(ap, args)
 
+  if args.xml_cache:
+    noitalib.xmltools.configure_cache(cache_dir=args.xml_cache)
+
   # Determine where Noita is installed
   steam_appid = args.steam_appid
   steam_game = args.steam_game
@@ -586,48 +915,61 @@ def main():
   # Initialize the internationalization system
   langmap = noitalib.translations.LanguageMap(game_path, args.language, defer=args.no_i18n)
 
-  # Handle internationalization arguments
-  if args.localize:
-    for token in args.localize:
-      print(langmap(token))
+  with _open_output(args) as report:
+    # Handle internationalization arguments
+    if args.localize:
+      for token in args.localize:
+        if report is not None:
+          report.write("localize", {"token": token, "value": langmap(token)})
+        else:
+          print(langmap(token))
+
+    if args.dump_i18n != UNSET:
+      if report is not None:
+        mode = get_language_map_mode(args.dump_i18n, args.language)
+        if mode is not None:
+          for record in language_map_records(langmap, mode, args.language):
+            report.write("token", record)
+      else:
+        print_language_map(langmap, args.dump_i18n, args.language)
+
+    # Enumerate the specific save directories
+    save_shared = get_saves(save_root, "save_shared")
+    save_main = get_saves(save_root, args.save)
+    save_dirs = [save_main]
+    if args.all_saves:
+      save_dirs = get_saves(save_root)
+
+    # Primary behaviors follow
+
+    if args.list_saves:
+      for save_dir in save_dirs:
+        save_name = os.path.basename(save_dir)
+        if report is not None:
+          report.write("save", {"name": save_name, "path": save_dir})
+        else:
+          print(f"{save_name} {save_dir}")
 
-  if args.dump_i18n != UNSET:
-    print_language_map(langmap, args.dump_i18n, args.language)
+    if args.decrypt_all or args.encrypt_all:
+      _main_convert_salakieli(save_dirs, args.encrypt_all, args.jobs)
 
-  # Enumerate the specific save directories
-  save_shared = get_saves(save_root, "save_shared")
-  save_main = get_saves(save_root, args.save)
-  save_dirs = [save_main]
-  if args.all_saves:
-    save_dirs = get_saves(save_root)
+    if args.list_mods:
+      _main_list_mods(steam_path, appid, game_path, args.detail, report)
 
-  # Primary behaviors follow
+    if args.list_sessions:
+      _main_list_sessions(save_dirs, langmap, args, detail, report)
 
-  if args.list_saves:
-    for save_dir in save_dirs:
-      save_name = os.path.basename(save_dir)
-      print(f"{save_name} {save_dir}")
+    if args.aggregate:
+      _main_aggregate(save_dirs, args, detail, report)
 
-  if args.list_mods:
-    _main_list_mods(steam_path, appid, game_path, args.detail)
+    if args.show_world:
+      _main_show_world(save_dirs, langmap, detail, report)
 
-  if args.list_sessions:
-    session_sort_key = lambda sess: sess["date"]
-    for save_dir in save_dirs:
-      sessions = filter_sessions(get_sessions(save_dir), args.session)
-      for session in sorted(sessions, key=session_sort_key):
-        print_session(save_dir, session, langmap,
-            show_stats=args.show_stats,
-            show_items=args.show_items,
-            show_biomes=args.show_biomes,
-            show_kills=args.show_kills,
-            detail=detail)
-
-  if args.show_world:
-    _main_show_world(save_dirs, langmap, detail=detail)
-
-  if args.show_player:
-    _main_show_players(save_dirs, langmap, detail=detail)
+    if args.show_player:
+      _main_show_players(save_dirs, langmap, detail, report)
+
+    if args.watch:
+      _main_watch(save_dirs, langmap, args, detail, report)
 
 if __name__ == "__main__":
   main()
@@ -10,6 +10,8 @@ from . import paths
 from . import world
 from . import orbs
 from . import player
+from . import aggregate
+from . import sessionindex
 
 from .constants import *
 from .sessions import *
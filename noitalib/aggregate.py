@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+
+"""
+Aggregate statistics over many play sessions
+
+A SessionTable stores sessions column-wise in compact arrays: one array
+per numeric stat, integer codes for textual values (build, cause of
+death, etc.), and sparse (session, enemy, count) arrays for the kill and
+death maps. Grouping and reducing then only loops over flat arrays:
+
+  table = SessionTable.from_sessions(sessions)
+  table.group_by("build", "playtime", "mean")
+  table.group_by(("month", "killed_by"))
+  table.kill_totals()
+
+Group keys are "build", "seed", "date", "month", "year", or any textual
+stat (see STAT_LABELS). Values to reduce are any numeric stat, plus
+"kill_count" and "death_count".
+
+to_bytes() and from_bytes() serialize a table as its raw arrays, so a
+table cached by sessionindex.SessionIndex.table() loads almost
+instantly.
+"""
+
+import array
+import json
+import math
+import struct
+
+import utility.loghelper
+logger = utility.loghelper.DelayLogger(__name__)
+
+# Stats with textual values; all other stats are numeric
+STAT_LABELS = ("killed_by", "killed_by_extra", "playtime_str")
+
+# Group keys derived from the date played
+DATE_KEYS = ("date", "month", "year")
+
+GROUP_KEYS = ("build", "seed") + DATE_KEYS + STAT_LABELS
+
+REDUCERS = ("count", "sum", "mean", "min", "max")
+
+MISSING = math.nan
+
+TABLE_MAGIC = b"NSESSTBL"
+TABLE_VERSION = 1
+# magic, version, length of the JSON metadata that follows
+TABLE_HEADER = struct.Struct("<8sIQ")
+
+def _to_float(value):
+  "Convert a stat value to a float; returns MISSING if it is not a number"
+  try:
+    return float(value)
+  except (TypeError, ValueError):
+    return MISSING
+
+class _Labels:
+  "Column of textual values stored as integer codes"
+  __slots__ = ("codes", "labels", "_lookup")
+
+  def __init__(self):
+    "See help(type(self))"
+    self.codes = array.array("I")
+    self.labels = []
+    self._lookup = {}
+
+  def code(self, label):
+    "Get the code for a label, adding the label if needed"
+    code = self._lookup.get(label)
+    if code is None:
+      code = self._lookup[label] = len(self.labels)
+      self.labels.append(label)
+    return code
+
+  def append(self, label):
+    "Append a value to the column"
+    self.codes.append(self.code(label))
+
+class _Sparse:
+  "Sparse (session row, label code, count) triples for a kill or death map"
+  __slots__ = ("rows", "codes", "counts", "labels")
+
+  def __init__(self, labels):
+    "See help(type(self))"
+    self.rows = array.array("I")
+    self.codes = array.array("I")
+    self.counts = array.array("q")
+    self.labels = labels
+
+  def extend(self, row, entries):
+    "Add the entries of a {label: count} map for the given row"
+    for label, count in entries.items():
+      self.rows.append(row)
+      self.codes.append(self.labels.code(label))
+      self.counts.append(count)
+
+class SessionTable:
+  "Columnar store of session data supporting group-by and reduce"
+  def __init__(self):
+    "See help(type(self))"
+    self._size = 0
+    self._seeds = array.array("q")
+    self._dates = array.array("I") # YYYYMMDD
+    self._builds = _Labels()
+    self._numeric = {
+      "kill_count": array.array("d"),
+      "death_count": array.array("d")
+    }
+    self._text = {name: _Labels() for name in STAT_LABELS}
+    self._enemies = _Labels()
+    self._maps = {
+      "kills": _Sparse(self._enemies),
+      "deaths": _Sparse(self._enemies)
+    }
+
+  def __len__(self):
+    "Number of sessions in the table"
+    return self._size
+
+  @classmethod
+  def from_sessions(cls, sessions):
+    "Create a table from parsed sessions (or SessionRefs)"
+    table = cls()
+    for session in sessions:
+      kills = session["kills"]
+      table.append(session["date"], session["seed"], session["build"],
+          session["stats"], kills.get("kills", {}), kills.get("deaths", {}),
+          kills.get("kill_count"), kills.get("death_count"))
+    return table
+
+  def _arrays(self):
+    """
+    Yield (array, kind) for every array in the table in a fixed order,
+    where kind is None for per-session arrays and the map kind otherwise
+    """
+    yield self._seeds, None
+    yield self._dates, None
+    yield self._builds.codes, None
+    for name in sorted(self._text):
+      yield self._text[name].codes, None
+    for name in sorted(self._numeric):
+      yield self._numeric[name], None
+    for kind in sorted(self._maps):
+      entries = self._maps[kind]
+      yield entries.rows, kind
+      yield entries.codes, kind
+      yield entries.counts, kind
+
+  def to_bytes(self):
+    "Serialize the table; see from_bytes()"
+    meta = {
+      "size": self._size,
+      "builds": self._builds.labels,
+      "text": {name: self._text[name].labels for name in sorted(self._text)},
+      "numeric": sorted(self._numeric),
+      "enemies": self._enemies.labels,
+      "maps": {kind: len(self._maps[kind].rows) for kind in self._maps}
+    }
+    meta_data = json.dumps(meta).encode()
+    parts = [TABLE_HEADER.pack(TABLE_MAGIC, TABLE_VERSION, len(meta_data)),
+        meta_data]
+    parts.extend(column.tobytes() for column, _ in self._arrays())
+    return b"".join(parts)
+
+  @classmethod
+  def from_bytes(cls, data):
+    "Deserialize a table created by to_bytes()"
+    magic, version, meta_size = TABLE_HEADER.unpack_from(data)
+    if magic != TABLE_MAGIC or version != TABLE_VERSION:
+      raise ValueError("Data is not a serialized SessionTable")
+    offset = TABLE_HEADER.size
+    meta = json.loads(data[offset:offset+meta_size])
+    offset += meta_size
+    table = cls()
+    table._size = meta["size"]
+    def load_labels(labels, names):
+      "Restore the labels of a _Labels instance"
+      labels.labels = names
+      labels._lookup = {name: code for code, name in enumerate(names)}
+    load_labels(table._builds, meta["builds"])
+    for name, names in meta["text"].items():
+      table._text[name] = _Labels()
+      load_labels(table._text[name], names)
+    for name in meta["numeric"]:
+      table._numeric[name] = array.array("d")
+    load_labels(table._enemies, meta["enemies"])
+    view = memoryview(data)
+    for column, kind in table._arrays():
+      count = table._size if kind is None else meta["maps"][kind]
+      nbytes = count * column.itemsize
+      column.frombytes(view[offset:offset+nbytes])
+      offset += nbytes
+    return table
+
+  def append(self, date, seed, build, stats, kills, deaths,
+      kill_count=None, death_count=None):
+    "Add a single session"
+    row = self._size
+    self._seeds.append(int(seed))
+    self._dates.append(date.year * 10000 + date.month * 100 + date.day)
+    self._builds.append(build)
+    for name, column in self._text.items():
+      column.append(stats.get(name, ""))
+    for name, value in stats.items():
+      if name in self._text:
+        continue
+      column = self._numeric.get(name)
+      if column is None:
+        column = self._numeric[name] = array.array("d", [MISSING]) * row
+      column.append(_to_float(value))
+    self._numeric["kill_count"].append(_to_float(kill_count))
+    self._numeric["death_count"].append(_to_float(death_count))
+    self._size += 1
+    # Stats absent from this session
+    for column in self._numeric.values():
+      if len(column) < self._size:
+        column.append(MISSING)
+    self._maps["kills"].extend(row, kills)
+    self._maps["deaths"].extend(row, deaths)
+
+  @property
+  def fields(self):
+    "Names of the numeric columns that can be reduced"
+    return sorted(self._numeric)
+
+  def column(self, name):
+    "Get a numeric column as an array of floats (NaN where missing)"
+    return self._numeric[name]
+
+  def _key_column(self, key):
+    "Get a sequence of per-row values and a function to label them"
+    if key == "build":
+      return self._builds.codes, self._builds.labels.__getitem__
+    if key == "seed":
+      return self._seeds, None
+    if key == "date":
+      return self._dates, lambda day: \
+          f"{day // 10000:04d}-{day // 100 % 100:02d}-{day % 100:02d}"
+    if key == "month":
+      return [day // 100 for day in self._dates], lambda month: \
+          f"{month // 100:04d}-{month % 100:02d}"
+    if key == "year":
+      return [day // 10000 for day in self._dates], None
+    if key in self._text:
+      column = self._text[key]
+      return column.codes, column.labels.__getitem__
+    raise KeyError(f"Cannot group by {key!r}; choices are {GROUP_KEYS}")
+
+  def _group_rows(self, keys):
+    "Get a list of group codes per row and a function to label the codes"
+    if isinstance(keys, str):
+      values, labeler = self._key_column(keys)
+      return values, labeler or (lambda value: value)
+    columns = [self._key_column(key) for key in keys]
+    def labeler(codes):
+      "Label a tuple of codes"
+      return tuple(label(code) if label else code
+          for code, (_, label) in zip(codes, columns))
+    return list(zip(*(values for values, _ in columns))), labeler
+
+  def group_by(self, keys, field=None, reduce="count"):
+    """
+    Group sessions by one key or a tuple of keys and reduce each group
+
+    With reduce="count", returns the number of sessions in each group.
+    Otherwise, reduces the numeric field using "sum", "mean", "min" or
+    "max", ignoring missing values. Returns a dict {group: value} sorted
+    by group.
+    """
+    if reduce not in REDUCERS:
+      raise ValueError(f"Invalid reduction {reduce!r}; choices are {REDUCERS}")
+    groups, labeler = self._group_rows(keys)
+    totals = {}
+    if reduce == "count":
+      for group in groups:
+        totals[group] = totals.get(group, 0) + 1
+    else:
+      if field is None:
+        raise ValueError(f"Reduction {reduce!r} requires a field")
+      counts = {}
+      for group, value in zip(groups, self.column(field)):
+        if value != value: # NaN; missing
+          continue
+        if reduce in ("sum", "mean"):
+          totals[group] = totals.get(group, 0) + value
+          counts[group] = counts.get(group, 0) + 1
+        elif group not in totals:
+          totals[group] = value
+        elif reduce == "min":
+          totals[group] = min(totals[group], value)
+        else:
+          totals[group] = max(totals[group], value)
+      if reduce == "mean":
+        totals = {group: total / counts[group]
+            for group, total in totals.items()}
+    return dict(sorted((labeler(group), total)
+      for group, total in totals.items()))
+
+  def kill_totals(self, kind="kills", keys=None):
+    """
+    Total the kill ("kills") or death ("deaths") maps per enemy
+
+    Returns a dict {enemy: total}. If keys are given, the sessions are
+    grouped as in group_by() and the result is {(group, enemy): total}.
+    """
+    entries = self._maps[kind]
+    labels = entries.labels.labels
+    totals = {}
+    if keys is None:
+      for code, count in zip(entries.codes, entries.counts):
+        totals[code] = totals.get(code, 0) + count
+      return dict(sorted(((labels[code], total)
+        for code, total in totals.items()), key=lambda kv: -kv[1]))
+    groups, labeler = self._group_rows(keys)
+    for row, code, count in zip(entries.rows, entries.codes, entries.counts):
+      group = (groups[row], code)
+      totals[group] = totals.get(group, 0) + count
+    return dict(sorted(((labeler(group), labels[code]), total)
+      for (group, code), total in totals.items()))
+
+def summary(table, key="build"):
+  """
+  Summarize the sessions grouped by the given key
+
+  Returns a list of dicts, one per group, holding the group (under the
+  key itself), the number of sessions, total and mean playtime in
+  seconds, mean gold, total kills and deaths, and the most common cause
+  of death.
+  """
+  def reduce(field, how):
+    "Reduce the field if any session has it"
+    if field not in table.fields:
+      return {}
+    return table.group_by(key, field, how)
+  counts = table.group_by(key)
+  playtime = reduce("playtime", "sum")
+  playtime_mean = reduce("playtime", "mean")
+  gold_mean = reduce("gold", "mean")
+  kills = reduce("kill_count", "sum")
+  deaths = reduce("dead", "sum")
+  causes = {}
+  for (group, cause), count in table.group_by((key, "killed_by")).items():
+    if cause and count > causes.get(group, ("", 0))[1]:
+      causes[group] = (cause, count)
+  records = []
+  for group, count in counts.items():
+    records.append({
+      key: group,
+      "sessions": count,
+      "playtime": playtime.get(group, 0),
+      "playtime_mean": playtime_mean.get(group, 0),
+      "gold_mean": gold_mean.get(group, 0),
+      "kills": kills.get(group, 0),
+      "deaths": deaths.get(group, 0),
+      "killed_by": causes.get(group, ("",))[0]
+    })
+  return records
+
+def summarize(table, key="build"):
+  """
+  Build a summary table of the sessions grouped by the given key
+
+  Returns a list of rows, starting with a header row.
+  """
+  rows = [(key, "sessions", "hours", "mean min", "mean gold", "kills",
+    "deaths", "top cause of death")]
+  for record in summary(table, key):
+    rows.append((str(record[key]), str(record["sessions"]),
+      f"{record['playtime'] / 3600:.1f}",
+      f"{record['playtime_mean'] / 60:.1f}",
+      f"{record['gold_mean']:.0f}",
+      f"{record['kills']:.0f}",
+      f"{record['deaths']:.0f}",
+      record["killed_by"]))
+  return rows
+
+# vim: set ts=2 sts=2 sw=2:
@@ -2,10 +2,67 @@
 
 """
 Provide methods to calculate a seed's AP and LC recipes.
+
+scan_seeds() searches a range of world seeds for recipes matching a
+predicate using a process pool. Run this module directly to calculate
+the recipes for specific seeds or to scan a seed range:
+
+  python -m noitalib.alchemy 1234 5678
+  python -m noitalib.alchemy --scan 1 4294967295 --lc lava --lc water
+
+calculate_recipes() and calculate_many() return AlchemyRecipes records,
+which write_jsonl() and write_csv() stream to a file.
+
+Seeds are scaled and advanced using exact fixed-point integers (see
+prng.scale_seed). cross_check() compares this against the equivalent
+decimal.Decimal computation for a random sample of seeds.
 """
 
+import argparse
+import collections
+import csv
+import functools
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import stat
+import sys
+import time
+
+import utility.loghelper
 from noitalib import materials
 from utility import prng
+logger = utility.loghelper.DelayLogger(__name__)
+
+SEED_MIN = 1
+SEED_MAX = 2**32 - 1
+
+# Noita skips the first six iterations (or uses them elsewhere)
+RECIPE_SKIP = 6
+# Probabilities are 10 + [0, 90]
+RECIPE_PROB_MIN = 10
+RECIPE_PROB_RANGE = 91
+SHUFFLE_OFFSET = 12534
+CHOOSE_ITER_LIMIT = 1000
+
+AlchemyRecipes = collections.namedtuple("AlchemyRecipes", (
+  "seed",       # world seed
+  "lc_set",     # the four LC candidate materials
+  "lc_recipe",  # the three LC materials
+  "lc_prob",    # LC probability
+  "ap_set",     # the four AP candidate materials
+  "ap_recipe",  # the three AP materials
+  "ap_prob"     # AP probability
+))
+AlchemyRecipes.__doc__ = "Both AP/LC candidate sets and recipes for a seed"
+
+CSV_MATERIAL_SEP = "+"
+
+SCAN_CHUNK_SIZE = 100000
+SCAN_REPORT_INTERVAL = 10 # seconds
 
 def shuffle_sequence(sequence, seed, inplace=False):
   "Shuffle a given sequence the way Noita does it"
@@ -13,13 +70,12 @@ def shuffle_sequence(sequence, seed, inplace=False):
   if not inplace:
     items = list(sequence)
 
-  seed = seed // 2 + 12534
+  seed = seed // 2 + SHUFFLE_OFFSET
   nrng = prng.NoitaRNG(seed)
   nrng.next()
   index = len(items) - 1
   while index >= 0:
-    rand = nrng.next() / prng.RAND_SCALE
-    target = int(rand * index)
+    target = index * nrng.next() // prng.RAND_SCALE
     items[index], items[target] = items[target], items[index]
     index -= 1
   return items
@@ -37,29 +93,493 @@ def aplc_get_set(nrng):
 
 def aplc_get_recipe(nrng, aplc_materials):
   "Calculate the final AP/LC recipe"
-  rng_scaled = nrng.next() / prng.RAND_SCALE
-  probability = 10 + int(rng_scaled * 91)
+  probability = RECIPE_PROB_MIN + nrng.select(RECIPE_PROB_RANGE)
   nrng.next()
 
-  recipe = shuffle_sequence(aplc_materials, nrng.seed)[:3]
+  recipe = shuffle_sequence(aplc_materials, int(nrng.seed // nrng.denom))[:3]
   return recipe, probability
 
-def calculate_ap_lc_recipe(seed):
-  "Calculate the recipe triplet for the given seed"
-  scaled_seed = seed * prng.SEED_SCALE + prng.SEED_OFFSET
-  nrng = prng.NoitaRNG(scaled_seed)
-  # Noita skips the first six iterations (or uses them elsewhere)
-  for _ in range(6):
-    nrng.next()
+def _calculate(seed, nrng=None):
+  """
+  Calculate both candidate sets and both recipes for the given seed
+
+  If given, nrng must be a NoitaRNG seeded with the scaled world seed.
+  """
+  if nrng is None:
+    nrng = prng.NoitaRNG(prng.scale_seed(seed), prng.SEED_DENOM)
+  nrng.skip(RECIPE_SKIP)
+  return _calculate_skipped(nrng)
 
+def _calculate_skipped(nrng):
+  "As _calculate(), once nrng has been advanced past the first draws"
   lc_mats = aplc_get_set(nrng)
   lc_recipe, lc_prob = aplc_get_recipe(nrng, lc_mats)
   ap_mats = aplc_get_set(nrng)
   ap_recipe, ap_prob = aplc_get_recipe(nrng, ap_mats)
+  return lc_mats, ap_mats, (lc_recipe, lc_prob, ap_recipe, ap_prob)
+
+def calculate_ap_lc_recipe(seed):
+  "Calculate the recipe triplet for the given seed"
+  lc_mats, ap_mats, result = _calculate(seed)
+  logger.debug("Seed %d LC set: %r; AP set: %r", seed, lc_mats, ap_mats)
+  return result
+
+def calculate_recipes(seed):
+  "Calculate the AlchemyRecipes for the given seed"
+  lc_mats, ap_mats, (lc_recipe, lc_prob, ap_recipe, ap_prob) = _calculate(seed)
+  return AlchemyRecipes(seed,
+      lc_mats, lc_recipe, lc_prob,
+      ap_mats, ap_recipe, ap_prob)
+
+def calculate_many(seeds):
+  "Lazily yield the AlchemyRecipes for each of the given seeds"
+  evaluator = RecipeEvaluator()
+  for seed in seeds:
+    yield evaluator.evaluate_recipes(seed)
+
+def _join_materials(mats, sep):
+  "Join material names; a material that could not be chosen (None) is empty"
+  return sep.join("" if mat is None else str(mat) for mat in mats)
+
+def _record_row(record):
+  "Convert an AlchemyRecipes to a flat list suitable for CSV"
+  row = list(record)
+  for field in ("lc_set", "lc_recipe", "ap_set", "ap_recipe"):
+    idx = AlchemyRecipes._fields.index(field)
+    row[idx] = _join_materials(row[idx], CSV_MATERIAL_SEP)
+  return row
+
+def write_jsonl(records, fobj, flush=False):
+  """
+  Write AlchemyRecipes as JSON, one object per line; returns the count
+
+  If flush is True, fobj is flushed after every record.
+  """
+  count = 0
+  for record in records:
+    fobj.write(json.dumps(record._asdict()))
+    fobj.write("\n")
+    if flush:
+      fobj.flush()
+    count += 1
+  return count
+
+def write_csv(records, fobj, header=True, flush=False):
+  """
+  Write AlchemyRecipes as CSV rows; returns the count
+
+  Materials within a set or recipe are joined by CSV_MATERIAL_SEP. If
+  flush is True, fobj is flushed after every record.
+  """
+  writer = csv.writer(fobj)
+  if header:
+    writer.writerow(AlchemyRecipes._fields)
+  count = 0
+  for record in records:
+    writer.writerow(_record_row(record))
+    if flush:
+      fobj.flush()
+    count += 1
+  return count
+
+def write_text(records, fobj, flush=False):
+  """
+  Write AlchemyRecipes as human-readable text; returns the count
+
+  If flush is True, fobj is flushed after every record.
+  """
+  count = 0
+  for record in records:
+    fobj.write(f"{record.seed} {format_recipes(record)}\n")
+    if flush:
+      fobj.flush()
+    count += 1
+  return count
+
+def _is_regular_file(fobj):
+  "True if fobj writes to a regular file, rather than a terminal or pipe"
+  try:
+    return stat.S_ISREG(os.fstat(fobj.fileno()).st_mode)
+  except (AttributeError, OSError, ValueError):
+    return False
+
+RECORD_WRITERS = {
+  "text": write_text,
+  "jsonl": write_jsonl,
+  "csv": write_csv
+}
+
+def _calculate_decimal(seed):
+  """
+  As _calculate(seed), but scale the seed using decimal.Decimal and
+  advance one draw at a time, so that no fixed-point code is involved
+  """
+  nrng = prng.NoitaRNG(seed * prng.SEED_SCALE + prng.SEED_OFFSET)
+  for _ in range(RECIPE_SKIP):
+    nrng.next()
+  return _calculate_skipped(nrng)
+
+def cross_check(num_seeds, rand_seed=None):
+  """
+  Compare the fixed-point and Decimal calculations for num_seeds random
+  world seeds. Returns the list of seeds that disagree.
+  """
+  rand = random.Random(rand_seed)
+  mismatches = []
+  for _ in range(num_seeds):
+    seed = rand.randint(SEED_MIN, SEED_MAX)
+    if _calculate(seed) != _calculate_decimal(seed):
+      logger.error("Seed %d: fixed-point and Decimal recipes differ", seed)
+      mismatches.append(seed)
+  return mismatches
+
+class RecipeEvaluator:
+  """
+  Reusable AP/LC recipe calculator for evaluating many seeds
+
+  Produces the same results as calculate_ap_lc_recipe(), but advances
+  the RNG inline on a fixed-point integer, represents materials as
+  indexes into materials.AP_LC_MATERIALS, and reuses preallocated
+  buffers for the candidate sets, their "seen" flags and the shuffle.
+  Instances are not thread-safe.
+  """
+  __slots__ = ("_unique", "_seen", "_clear", "_lc_set", "_ap_set", "_order")
+
+  _DENOM = prng.SEED_DENOM
+  _DIV = prng.RAND_DIV * prng.SEED_DENOM
+  _MOD = prng.RAND_MOD * prng.SEED_DENOM
+  _MAX = prng.RAND_MAX * prng.SEED_DENOM
+  _SCALE = prng.RAND_SCALE * prng.SEED_DENOM
+  _SKIP_MULT = pow(prng.RAND_COEFF, RECIPE_SKIP, prng.RAND_MAX * prng.SEED_DENOM)
+  _NUM_LIQUIDS = len(materials.AP_LC_LIQUIDS)
+  _NUM_ORGANICS = len(materials.AP_LC_ORGANICS)
+
+  def __init__(self, unique=False):
+    """
+    See help(type(self))
+
+    The unique argument mirrors prng.NoitaRNG.choose(); Noita does not
+    use it for AP/LC recipes.
+    """
+    self._unique = unique
+    self._seen = bytearray(len(materials.AP_LC_MATERIALS))
+    self._clear = bytes(len(self._seen))
+    self._lc_set = [0, 0, 0, 0]
+    self._ap_set = [0, 0, 0, 0]
+    self._order = [0, 1, 2, 3]
+
+  def _shuffle_order(self, seed):
+    "Shuffle the candidate positions as shuffle_sequence() would"
+    order = self._order
+    order[0], order[1], order[2], order[3] = 0, 1, 2, 3
+    rand_div, rand_mod = prng.RAND_DIV, prng.RAND_MOD
+    rand_coeff, rand_max = prng.RAND_COEFF, prng.RAND_MAX
+    value = seed // 2 + SHUFFLE_OFFSET
+    value = (value % rand_div) * rand_coeff - (value // rand_div) * rand_mod
+    if value <= 0:
+      value += rand_max
+    for index in range(len(order) - 1, -1, -1):
+      value = (value % rand_div) * rand_coeff - (value // rand_div) * rand_mod
+      if value <= 0:
+        value += rand_max
+      target = index * value // prng.RAND_SCALE
+      order[index], order[target] = order[target], order[index]
+
+  def _get_set(self, value, mat_set):
+    "Fill mat_set as aplc_get_set() would; returns the new RNG value"
+    rand_div, rand_mod, rand_max = self._DIV, self._MOD, self._MAX
+    rand_coeff, rand_scale = prng.RAND_COEFF, self._SCALE
+    seen = self._seen
+    seen[:] = self._clear
+    for slot in range(4):
+      first, count = 0, self._NUM_LIQUIDS
+      if slot == 3:
+        first, count = self._NUM_LIQUIDS, self._NUM_ORGANICS
+      mat_set[slot] = -1
+      for _ in range(CHOOSE_ITER_LIMIT):
+        value = (value % rand_div) * rand_coeff - (value // rand_div) * rand_mod
+        if value <= 0:
+          value += rand_max
+        index = first + count * value // rand_scale
+        if not self._unique or not seen[index]:
+          seen[index] = 1
+          mat_set[slot] = index
+          break
+    return value
+
+  def _get_recipe(self, value, mat_set):
+    "Calculate the probability and recipe; returns (value, recipe, prob)"
+    rand_div, rand_mod, rand_max = self._DIV, self._MOD, self._MAX
+    rand_coeff = prng.RAND_COEFF
+    value = (value % rand_div) * rand_coeff - (value // rand_div) * rand_mod
+    if value <= 0:
+      value += rand_max
+    probability = RECIPE_PROB_MIN + RECIPE_PROB_RANGE * value // self._SCALE
+    value = (value % rand_div) * rand_coeff - (value // rand_div) * rand_mod
+    if value <= 0:
+      value += rand_max
+    order = self._order
+    recipe = (mat_set[order[0]], mat_set[order[1]], mat_set[order[2]])
+    return value, recipe, probability
+
+  def evaluate(self, seed):
+    """
+    Calculate (lc_recipe, lc_prob, ap_recipe, ap_prob) for the given seed
+
+    Recipes are tuples of indexes into materials.AP_LC_MATERIALS. With
+    unique=True, a material that could not be chosen is given as -1.
+    """
+    scaled_seed = prng.scale_seed(seed)
+    value = scaled_seed * self._SKIP_MULT % self._MAX
+    if value <= 0:
+      value += self._MAX
+    self._shuffle_order(scaled_seed // self._DENOM)
+    value = self._get_set(value, self._lc_set)
+    value, lc_recipe, lc_prob = self._get_recipe(value, self._lc_set)
+    value = self._get_set(value, self._ap_set)
+    value, ap_recipe, ap_prob = self._get_recipe(value, self._ap_set)
+    return lc_recipe, lc_prob, ap_recipe, ap_prob
+
+  def evaluate_names(self, seed):
+    "As evaluate(), but return recipes as lists of material names"
+    lc_recipe, lc_prob, ap_recipe, ap_prob = self.evaluate(seed)
+    return self._names(lc_recipe), lc_prob, self._names(ap_recipe), ap_prob
+
+  def evaluate_recipes(self, seed):
+    "As evaluate(), but return an AlchemyRecipes record"
+    lc_recipe, lc_prob, ap_recipe, ap_prob = self.evaluate(seed)
+    return AlchemyRecipes(seed,
+        self._names(self._lc_set), self._names(lc_recipe), lc_prob,
+        self._names(self._ap_set), self._names(ap_recipe), ap_prob)
+
+  @staticmethod
+  def _names(indexes):
+    "Convert material indexes to a list of material names"
+    names = materials.AP_LC_MATERIALS
+    return [names[idx] if idx >= 0 else None for idx in indexes]
+
+class RecipeFilter:
+  """
+  Picklable scan_seeds() predicate matching recipes by their materials
+
+  A seed matches if its LC recipe contains every material in lc, its AP
+  recipe contains every material in ap, and both probabilities are at
+  least min_prob.
+  """
+  def __init__(self, lc=(), ap=(), min_prob=0):
+    "See help(type(self))"
+    self._lc = frozenset(lc)
+    self._ap = frozenset(ap)
+    self._min_prob = min_prob
+
+  def __call__(self, lc_recipe, lc_prob, ap_recipe, ap_prob):
+    "True if the recipes satisfy this filter"
+    if lc_prob < self._min_prob or ap_prob < self._min_prob:
+      return False
+    return self._lc.issubset(lc_recipe) and self._ap.issubset(ap_recipe)
+
+  def __repr__(self):
+    "repr(self)"
+    return "RecipeFilter(lc={}, ap={}, min_prob={})".format(
+        sorted(self._lc), sorted(self._ap), self._min_prob)
+
+def _scan_chunk(predicate, bounds):
+  "Scan a single [start, stop) chunk of seeds; runs in a worker process"
+  start, stop = bounds
+  matches = []
+  evaluator = RecipeEvaluator()
+  for seed in range(start, stop):
+    result = evaluator.evaluate_names(seed)
+    if predicate(*result):
+      matches.append(evaluator.evaluate_recipes(seed))
+  return bounds, matches
+
+def _merge_ranges(ranges):
+  "Merge a collection of [start, stop) pairs into sorted disjoint pairs"
+  merged = []
+  for start, stop in sorted(ranges):
+    if merged and start <= merged[-1][1]:
+      merged[-1][1] = max(merged[-1][1], stop)
+    else:
+      merged.append([start, stop])
+  return merged
+
+def load_checkpoint(path, start, stop):
+  "Load the ranges already scanned from a checkpoint file, if present"
+  try:
+    with open(path, "rt") as fobj:
+      state = json.load(fobj)
+  except FileNotFoundError:
+    return []
+  params = (state["start"], state["stop"])
+  if params != (start, stop):
+    raise ValueError(f"Checkpoint {path!r} is for a different scan: {params}")
+  return _merge_ranges(state["done"])
+
+def save_checkpoint(path, start, stop, done):
+  "Atomically write the ranges scanned so far to a checkpoint file"
+  state = {
+    "start": start,
+    "stop": stop,
+    "done": _merge_ranges(done)
+  }
+  temp_path = path + os.extsep + "tmp"
+  with open(temp_path, "wt") as fobj:
+    json.dump(state, fobj)
+  os.replace(temp_path, path)
+
+def _iter_chunks(start, stop, chunk_size, done):
+  "Yield the [start, stop) chunks not covered by the done ranges"
+  done = iter(_merge_ranges(done))
+  skip = next(done, None)
+  for chunk_start in range(start, stop, chunk_size):
+    chunk_stop = min(chunk_start + chunk_size, stop)
+    while skip is not None and skip[1] <= chunk_start:
+      skip = next(done, None)
+    if skip is not None and skip[0] <= chunk_start and chunk_stop <= skip[1]:
+      continue
+    yield chunk_start, chunk_stop
+
+def scan_seeds(predicate,
+    start=SEED_MIN,
+    stop=SEED_MAX + 1,
+    workers=None,
+    chunk_size=SCAN_CHUNK_SIZE,
+    checkpoint=None,
+    report_interval=SCAN_REPORT_INTERVAL):
+  """
+  Yield the AlchemyRecipes for each seed in [start, stop) for which
+  predicate(lc_recipe, lc_prob, ap_recipe, ap_prob) is true
+
+  The range is split into chunk_size chunks and distributed across
+  workers processes (default: all cores). Matches are yielded as each
+  chunk finishes, so they are grouped by chunk but not globally ordered.
+  The predicate must be picklable; see RecipeFilter.
+
+  If checkpoint names a file, completed chunks are recorded there and
+  skipped when a scan of the same range is started again. A chunk counts
+  as completed once all of its matches have been yielded; matches from
+  chunks completed by a previous run are not yielded again.
+  """
+  done = []
+  if checkpoint is not None:
+    done = load_checkpoint(checkpoint, start, stop)
+  total = stop - start
+  scanned = sum(min(high, stop) - max(low, start) for low, high in done)
+  if scanned:
+    logger.info("Resuming scan; %d of %d seeds already scanned",
+        scanned, total)
+
+  num_matches = 0
+  num_scanned = 0
+  time_start = time.monotonic()
+  time_report = time_start
+  scan_func = functools.partial(_scan_chunk, predicate)
+  with multiprocessing.Pool(workers) as pool:
+    try:
+      chunks = _iter_chunks(start, stop, chunk_size, done)
+      for bounds, matches in pool.imap_unordered(scan_func, chunks):
+        yield from matches
+        done.append(list(bounds))
+        num_scanned += bounds[1] - bounds[0]
+        num_matches += len(matches)
+        now = time.monotonic()
+        if now - time_report >= report_interval:
+          time_report = now
+          logger.info("Scanned %d/%d seeds (%.2f%%); %.0f seeds/sec; %d matches",
+              scanned + num_scanned, total,
+              (scanned + num_scanned) * 100 / total,
+              num_scanned / (now - time_start), num_matches)
+          if checkpoint is not None:
+            save_checkpoint(checkpoint, start, stop, done)
+    finally:
+      if checkpoint is not None:
+        save_checkpoint(checkpoint, start, stop, done)
+
+  elapsed = time.monotonic() - time_start
+  logger.info("Scanned %d seeds in %.2f sec (%.0f seeds/sec); %d matches",
+      num_scanned, elapsed, num_scanned / elapsed if elapsed else 0,
+      num_matches)
+
+def format_recipes(record):
+  "Format an AlchemyRecipes' recipes as a single line of text"
+  lc_str = _join_materials(record.lc_recipe, ", ")
+  ap_str = _join_materials(record.ap_recipe, ", ")
+  return f"LC: {lc_str} ({record.lc_prob}%) AP: {ap_str} ({record.ap_prob}%)"
+
+def main():
+  "Entry point"
+  ap = argparse.ArgumentParser(
+      description="calculate Lively Concoction and Alchemic Precursor recipes")
+  ap.add_argument("seed", type=int, nargs="*", help="world seed(s)")
+  ag = ap.add_argument_group("seed scanning")
+  ag.add_argument("--scan", type=int, nargs=2, metavar=("START", "STOP"),
+      help="scan seeds START through STOP inclusive")
+  ag.add_argument("--lc", metavar="MAT", action="append", default=[],
+      help="require %(metavar)s in the LC recipe (may be repeated)")
+  ag.add_argument("--ap", metavar="MAT", action="append", default=[],
+      help="require %(metavar)s in the AP recipe (may be repeated)")
+  ag.add_argument("--min-prob", type=int, metavar="NUM", default=0,
+      help="require both probabilities to be at least %(metavar)s")
+  ag.add_argument("-j", "--jobs", type=int, metavar="NUM",
+      help="number of worker processes (default: all cores)")
+  ag.add_argument("--chunk-size", type=int, metavar="NUM",
+      default=SCAN_CHUNK_SIZE,
+      help="seeds per work unit (default: %(default)s)")
+  ag.add_argument("--checkpoint", metavar="PATH",
+      help="record progress to %(metavar)s and resume from it")
+  ag = ap.add_argument_group("output")
+  ag.add_argument("-f", "--format", choices=RECORD_WRITERS, default="text",
+      help="output format (default: %(default)s)")
+  ag.add_argument("-o", "--output", metavar="PATH",
+      help="write results to %(metavar)s instead of stdout")
+  ag = ap.add_argument_group("verification")
+  ag.add_argument("--cross-check", type=int, metavar="NUM",
+      help="compare fixed-point and Decimal results for %(metavar)s seeds")
+  ap.add_argument("-v", "--verbose", action="store_true", help="verbose output")
+  args = ap.parse_args()
+  logging.basicConfig(format="%(module)s: %(levelname)s: %(message)s",
+      level=logging.DEBUG if args.verbose else logging.INFO, force=True)
+
+  known = set(materials.AP_LC_LIQUIDS + materials.AP_LC_ORGANICS)
+  for mat in args.lc + args.ap:
+    if mat not in known:
+      ap.error(f"unknown material {mat!r}")
+
+  if args.cross_check:
+    mismatches = cross_check(args.cross_check)
+    logger.info("Checked %d seeds; %d mismatches",
+        args.cross_check, len(mismatches))
+    if mismatches:
+      raise SystemExit(1)
+
+  records = calculate_many(args.seed)
+  if args.scan:
+    scan_start, scan_stop = args.scan
+    predicate = RecipeFilter(lc=args.lc, ap=args.ap, min_prob=args.min_prob)
+    logger.info("Scanning seeds %d to %d for %r",
+        scan_start, scan_stop, predicate)
+    records = itertools.chain(records, scan_seeds(predicate,
+        start=scan_start,
+        stop=scan_stop + 1,
+        workers=args.jobs,
+        chunk_size=args.chunk_size,
+        checkpoint=args.checkpoint))
 
-  print(lc_mats)
-  print(ap_mats)
+  fobj = sys.stdout
+  if args.output:
+    fobj = open(args.output, "wt", newline="")
+  try:
+    # Show each match as soon as it is found unless writing to a file
+    RECORD_WRITERS[args.format](records, fobj,
+        flush=not _is_regular_file(fobj))
+  except KeyboardInterrupt:
+    logger.warning("Interrupted")
+  finally:
+    if fobj is not sys.stdout:
+      fobj.close()
 
-  return lc_recipe, lc_prob, ap_recipe, ap_prob
+if __name__ == "__main__":
+  main()
 
 # vim: set ts=2 sts=2 sw=2:
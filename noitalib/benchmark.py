@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+"""
+Measure the throughput of the RNG, alchemy and seed scanning code
+
+Run this module directly to benchmark everything available:
+
+  python -m noitalib.benchmark
+  python -m noitalib.benchmark --quick --output results.json
+
+Results are written as a single JSON object containing the environment
+and one entry per benchmark. Each entry gives the number of operations
+performed, the best time over all repetitions, and the resulting rate.
+The scan benchmark runs once for each worker count from 1 to --max-jobs
+and includes process pool startup.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import sys
+import time
+
+import utility.loghelper
+from noitalib import alchemy
+from utility import prng
+logger = utility.loghelper.DelayLogger(__name__)
+
+BENCH_SEED = 1234
+
+def _time_best(func, repeat):
+  "Call func() repeat times and return the shortest duration"
+  best = None
+  for _ in range(repeat):
+    time_start = time.perf_counter()
+    func()
+    duration = time.perf_counter() - time_start
+    if best is None or duration < best:
+      best = duration
+  return best
+
+def _result(name, unit, count, duration, **extra):
+  "Build a single benchmark result"
+  result = {
+    "name": name,
+    "unit": unit,
+    "count": count,
+    "seconds": duration,
+    "rate": count / duration if duration > 0 else None
+  }
+  result.update(extra)
+  logger.info("%s: %.0f %s/sec", name, result["rate"] or 0, unit)
+  return result
+
+def bench_rng_next(count, repeat):
+  "NoitaRNG.next() called in a loop"
+  def func():
+    rng = prng.NoitaRNG(BENCH_SEED)
+    for _ in range(count):
+      rng.next()
+  return _result("rng.next", "draws", count, _time_best(func, repeat))
+
+def bench_rng_next_n(count, repeat):
+  "NoitaRNG.next_n()"
+  def func():
+    prng.NoitaRNG(BENCH_SEED).next_n(count)
+  return _result("rng.next_n", "draws", count, _time_best(func, repeat))
+
+def bench_rng_skip(count, repeat):
+  "NoitaRNG.skip() by a large distance, count times"
+  def func():
+    rng = prng.NoitaRNG(BENCH_SEED)
+    for _ in range(count):
+      rng.skip(2**40)
+  return _result("rng.skip", "skips", count, _time_best(func, repeat))
+
+def bench_rng_array(count, repeat, width=10000):
+  "NoitaRNGArray.next() over width seeds"
+  steps = max(1, count // width)
+  def func():
+    rng = prng.NoitaRNGArray(range(1, width + 1))
+    for _ in range(steps):
+      rng.next()
+  return _result("rng.array", "draws", steps * width,
+      _time_best(func, repeat), width=width)
+
+def bench_recipe(count, repeat):
+  "alchemy.calculate_ap_lc_recipe()"
+  def func():
+    for seed in range(1, count + 1):
+      alchemy.calculate_ap_lc_recipe(seed)
+  return _result("alchemy.calculate_ap_lc_recipe", "seeds", count,
+      _time_best(func, repeat))
+
+def bench_evaluator(count, repeat):
+  "alchemy.RecipeEvaluator.evaluate()"
+  def func():
+    evaluator = alchemy.RecipeEvaluator()
+    for seed in range(1, count + 1):
+      evaluator.evaluate(seed)
+  return _result("alchemy.RecipeEvaluator", "seeds", count,
+      _time_best(func, repeat))
+
+def bench_scan(count, repeat, workers):
+  "alchemy.scan_seeds() with a predicate that never matches"
+  # Impossible probability; every seed is evaluated and none match
+  predicate = alchemy.RecipeFilter(min_prob=alchemy.RECIPE_PROB_MIN
+      + alchemy.RECIPE_PROB_RANGE)
+  chunk_size = max(1, count // (workers * 8))
+  def func():
+    for _ in alchemy.scan_seeds(predicate, start=1, stop=count + 1,
+        workers=workers, chunk_size=chunk_size, report_interval=sys.maxsize):
+      pass
+  return _result("alchemy.scan_seeds", "seeds", count,
+      _time_best(func, repeat), workers=workers)
+
+def get_environment():
+  "Describe the machine and software running the benchmarks"
+  return {
+    "date": datetime.datetime.now().isoformat(timespec="seconds"),
+    "python": platform.python_version(),
+    "implementation": platform.python_implementation(),
+    "platform": platform.platform(),
+    "machine": platform.machine(),
+    "cpu_count": os.cpu_count(),
+    "numpy": prng.numpy.__version__ if prng.HAVE_NUMPY else None
+  }
+
+def run_benchmarks(scale=1, repeat=3, max_jobs=None):
+  """
+  Run all available benchmarks and return the results as a dict
+
+  The scale multiplies the amount of work each benchmark does.
+  """
+  if max_jobs is None:
+    max_jobs = os.cpu_count() or 1
+  def amount(base):
+    "Scale a base amount of work"
+    return max(1, int(base * scale))
+  results = []
+  results.append(bench_rng_next(amount(200000), repeat))
+  results.append(bench_rng_next_n(amount(200000), repeat))
+  results.append(bench_rng_skip(amount(20000), repeat))
+  if prng.HAVE_NUMPY:
+    results.append(bench_rng_array(amount(2000000), repeat))
+  else:
+    logger.info("numpy not available; skipping rng.array")
+  results.append(bench_recipe(amount(10000), repeat))
+  results.append(bench_evaluator(amount(10000), repeat))
+  scan_results = []
+  for workers in range(1, max_jobs + 1):
+    scan_results.append(bench_scan(amount(20000) * workers, 1, workers))
+  base_rate = scan_results[0]["rate"]
+  for scan_result in scan_results:
+    scan_result["speedup"] = scan_result["rate"] / base_rate
+  results.extend(scan_results)
+  return {"environment": get_environment(), "results": results}
+
+def main():
+  "Entry point"
+  ap = argparse.ArgumentParser(
+      description="benchmark the RNG, alchemy and seed scanning code")
+  ap.add_argument("--quick", action="store_true",
+      help="do a tenth of the usual work and skip repetitions")
+  ap.add_argument("--scale", type=float, metavar="NUM", default=1,
+      help="multiply the amount of work by %(metavar)s")
+  ap.add_argument("--repeat", type=int, metavar="NUM", default=3,
+      help="repeat each benchmark %(metavar)s times (default: %(default)s)")
+  ap.add_argument("-j", "--max-jobs", type=int, metavar="NUM",
+      help="measure scanning with 1 to %(metavar)s workers (default: all cores)")
+  ap.add_argument("-o", "--output", metavar="PATH",
+      help="write results to %(metavar)s instead of stdout")
+  ap.add_argument("-v", "--verbose", action="store_true",
+      help="report each result as it is measured")
+  args = ap.parse_args()
+  logging.basicConfig(format="%(module)s: %(levelname)s: %(message)s",
+      level=logging.INFO if args.verbose else logging.WARNING, force=True)
+
+  scale, repeat = args.scale, args.repeat
+  if args.quick:
+    scale, repeat = scale / 10, 1
+  results = run_benchmarks(scale=scale, repeat=repeat, max_jobs=args.max_jobs)
+
+  if args.output:
+    with open(args.output, "wt") as fobj:
+      json.dump(results, fobj, indent=2)
+  else:
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+if __name__ == "__main__":
+  main()
+
+# vim: set ts=2 sts=2 sw=2:
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+
+"""
+Golden-vector corpus guarding the RNG and alchemy implementations
+
+The corpus records, for a fixed set of world seeds, the first few RNG
+values and the AP/LC candidate sets, recipes and probabilities. Every
+implementation (scalar, batched, parallel) must reproduce it exactly:
+
+  python -m noitalib.golden               verify every available backend
+  python -m noitalib.golden -b rng.array  verify a single backend
+  python -m noitalib.golden --generate    regenerate the corpus
+
+Only regenerate the corpus after confirming the new results are correct;
+verification is meaningless against a corpus produced by broken code.
+
+The corpus is a gzip-compressed binary file: a header, then one
+fixed-width record per seed holding the seed, two RNG streams (seeded
+with the integer scaled seed and with the exact fixed-point scaled seed,
+see prng.scale_seed) and both recipes as indexes into
+materials.AP_LC_MATERIALS.
+"""
+
+import argparse
+import collections
+import gzip
+import logging
+import os
+import random
+import struct
+import sys
+
+import utility.loghelper
+from noitalib import alchemy
+from noitalib import materials
+from utility import prng
+logger = utility.loghelper.DelayLogger(__name__)
+
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), "golden.bin.gz")
+GOLDEN_MAGIC = b"NGOLDEN\0"
+GOLDEN_VERSION = 1
+# magic, version, number of seeds, RNG stream length
+HEADER = struct.Struct("<8sIII")
+# seed, LC set, LC recipe, LC probability, AP set, AP recipe, AP probability
+RECIPES = struct.Struct("<I4s3sB4s3sB")
+
+STREAM_LENGTH = 8
+# Seeds 1 through this are contiguous, for the range-based backends
+CONTIGUOUS_SEEDS = 256
+RANDOM_SEEDS = 256
+RANDOM_STATE = 20221013
+EDGE_SEEDS = (
+  2**16, 2**24, 2**31 - 2, 2**31 - 1, 2**31, 2**31 + 1, 2**32 - 2, 2**32 - 1
+)
+
+GoldenVector = collections.namedtuple("GoldenVector", (
+  "seed",         # world seed
+  "int_stream",   # NoitaRNG(scale_seed(seed) // SEED_DENOM) values
+  "fixed_stream", # NoitaRNG(scale_seed(seed), SEED_DENOM) values
+  "recipes"       # alchemy.AlchemyRecipes
+))
+
+def corpus_seeds():
+  "Get the world seeds the corpus covers"
+  rand = random.Random(RANDOM_STATE)
+  seeds = list(range(1, CONTIGUOUS_SEEDS + 1))
+  seeds.extend(EDGE_SEEDS)
+  seeds.extend(rand.randint(alchemy.SEED_MIN, alchemy.SEED_MAX)
+      for _ in range(RANDOM_SEEDS))
+  return seeds
+
+def _encode_mats(mats):
+  "Encode material names as indexes"
+  return bytes(materials.AP_LC_INDEX[mat] for mat in mats)
+
+def _decode_mats(data):
+  "Decode material indexes to names"
+  return [materials.AP_LC_MATERIALS[idx] for idx in data]
+
+def _stream_struct(length):
+  "Get the Struct for the two RNG streams"
+  return struct.Struct(f"<{length * 2}q")
+
+def make_vector(seed, length=STREAM_LENGTH):
+  "Compute a GoldenVector using the reference implementation"
+  int_rng = prng.NoitaRNG(prng.scale_seed(seed) // prng.SEED_DENOM)
+  fixed_rng = prng.NoitaRNG(prng.scale_seed(seed), prng.SEED_DENOM)
+  return GoldenVector(seed,
+      [int_rng.next() for _ in range(length)],
+      [fixed_rng.next() for _ in range(length)],
+      alchemy.calculate_recipes(seed))
+
+def generate_corpus(path=GOLDEN_PATH, length=STREAM_LENGTH):
+  "Write a new corpus; returns the number of vectors"
+  seeds = corpus_seeds()
+  streams = _stream_struct(length)
+  with gzip.open(path, "wb") as fobj:
+    fobj.write(HEADER.pack(GOLDEN_MAGIC, GOLDEN_VERSION, len(seeds), length))
+    for seed in seeds:
+      vector = make_vector(seed, length)
+      rec = vector.recipes
+      fobj.write(RECIPES.pack(seed,
+        _encode_mats(rec.lc_set), _encode_mats(rec.lc_recipe), rec.lc_prob,
+        _encode_mats(rec.ap_set), _encode_mats(rec.ap_recipe), rec.ap_prob))
+      fobj.write(streams.pack(*vector.int_stream, *vector.fixed_stream))
+  return len(seeds)
+
+def load_corpus(path=GOLDEN_PATH):
+  "Read the corpus as a list of GoldenVector"
+  with gzip.open(path, "rb") as fobj:
+    data = fobj.read()
+  magic, version, num_seeds, length = HEADER.unpack_from(data)
+  if magic != GOLDEN_MAGIC or version != GOLDEN_VERSION:
+    raise ValueError(f"{path!r} is not a golden-vector corpus")
+  streams = _stream_struct(length)
+  vectors = []
+  offset = HEADER.size
+  for _ in range(num_seeds):
+    seed, lc_set, lc_recipe, lc_prob, ap_set, ap_recipe, ap_prob = \
+        RECIPES.unpack_from(data, offset)
+    offset += RECIPES.size
+    values = streams.unpack_from(data, offset)
+    offset += streams.size
+    recipes = alchemy.AlchemyRecipes(seed,
+        _decode_mats(lc_set), _decode_mats(lc_recipe), lc_prob,
+        _decode_mats(ap_set), _decode_mats(ap_recipe), ap_prob)
+    vectors.append(GoldenVector(seed,
+      list(values[:length]), list(values[length:]), recipes))
+  return vectors
+
+# Backends; each returns the number of vectors that disagree {{{0
+
+def _check(backend, vector, field, actual, expected):
+  "Compare one result; returns 1 on mismatch and 0 otherwise"
+  if list(actual) != list(expected):
+    logger.error("%s: seed %d %s mismatch: got %r, expected %r",
+        backend, vector.seed, field, actual, expected)
+    return 1
+  return 0
+
+def _new_rngs(vector):
+  "Create the integer and fixed-point NoitaRNGs for a vector"
+  return (prng.NoitaRNG(prng.scale_seed(vector.seed) // prng.SEED_DENOM),
+      prng.NoitaRNG(prng.scale_seed(vector.seed), prng.SEED_DENOM))
+
+def verify_rng_scalar(vectors):
+  "NoitaRNG.next()"
+  failures = 0
+  for vector in vectors:
+    int_rng, fixed_rng = _new_rngs(vector)
+    length = len(vector.int_stream)
+    failures += _check("rng.scalar", vector, "int_stream",
+        [int_rng.next() for _ in range(length)], vector.int_stream)
+    failures += _check("rng.scalar", vector, "fixed_stream",
+        [fixed_rng.next() for _ in range(length)], vector.fixed_stream)
+  return failures
+
+def verify_rng_definition(vectors):
+  """
+  The corpus RNG streams against the Lehmer definition, a * value mod m,
+  computed without Schrage's method (and so independently of NoitaRNG)
+  """
+  failures = 0
+  for vector in vectors:
+    scaled = prng.scale_seed(vector.seed)
+    for field, value, modulus in (
+        ("int_stream", scaled // prng.SEED_DENOM, prng.RAND_MAX),
+        ("fixed_stream", scaled, prng.RAND_MAX * prng.SEED_DENOM)):
+      values = []
+      for _ in getattr(vector, field):
+        value = value * prng.RAND_COEFF % modulus or modulus
+        values.append(value)
+      failures += _check("rng.definition", vector, field,
+          values, getattr(vector, field))
+  return failures
+
+def verify_rng_next_n(vectors):
+  "NoitaRNG.next_n()"
+  failures = 0
+  for vector in vectors:
+    int_rng, fixed_rng = _new_rngs(vector)
+    length = len(vector.int_stream)
+    failures += _check("rng.next_n", vector, "int_stream",
+        int_rng.next_n(length), vector.int_stream)
+    failures += _check("rng.next_n", vector, "fixed_stream",
+        fixed_rng.next_n(length), vector.fixed_stream)
+  return failures
+
+def verify_rng_skip(vectors):
+  "NoitaRNG.skip()"
+  failures = 0
+  for vector in vectors:
+    int_values, fixed_values = [], []
+    for count in range(1, len(vector.int_stream) + 1):
+      int_rng, fixed_rng = _new_rngs(vector)
+      int_values.append(int_rng.skip(count))
+      fixed_values.append(fixed_rng.skip(count))
+    failures += _check("rng.skip", vector, "int_stream",
+        int_values, vector.int_stream)
+    failures += _check("rng.skip", vector, "fixed_stream",
+        fixed_values, vector.fixed_stream)
+  return failures
+
+def verify_rng_array(vectors):
+  "NoitaRNGArray.next_n() and NoitaRNGArray.skip()"
+  failures = 0
+  length = len(vectors[0].int_stream)
+  scaled = [prng.scale_seed(vector.seed) for vector in vectors]
+  int_rng = prng.NoitaRNGArray([seed // prng.SEED_DENOM for seed in scaled])
+  fixed_rng = prng.NoitaRNGArray(scaled, prng.SEED_DENOM)
+  int_values = int_rng.next_n(length)
+  fixed_values = fixed_rng.next_n(length)
+  int_rng = prng.NoitaRNGArray([seed // prng.SEED_DENOM for seed in scaled])
+  fixed_rng = prng.NoitaRNGArray(scaled, prng.SEED_DENOM)
+  int_last = int_rng.skip(length)
+  fixed_last = fixed_rng.skip(length)
+  for idx, vector in enumerate(vectors):
+    failures += _check("rng.array", vector, "int_stream",
+        int_values[:, idx].tolist(), vector.int_stream)
+    failures += _check("rng.array", vector, "fixed_stream",
+        fixed_values[:, idx].tolist(), vector.fixed_stream)
+    failures += _check("rng.array", vector, "int_stream skip",
+        [int_last[idx]], vector.int_stream[-1:])
+    failures += _check("rng.array", vector, "fixed_stream skip",
+        [fixed_last[idx]], vector.fixed_stream[-1:])
+  return failures
+
+def verify_alchemy_scalar(vectors):
+  "alchemy.calculate_recipes() and alchemy.calculate_ap_lc_recipe()"
+  failures = 0
+  for vector in vectors:
+    rec = vector.recipes
+    failures += _check("alchemy.scalar", vector, "recipes",
+        alchemy.calculate_recipes(vector.seed), rec)
+    failures += _check("alchemy.scalar", vector, "recipe",
+        alchemy.calculate_ap_lc_recipe(vector.seed),
+        (rec.lc_recipe, rec.lc_prob, rec.ap_recipe, rec.ap_prob))
+  return failures
+
+def verify_alchemy_decimal(vectors):
+  "The decimal.Decimal reference calculation"
+  failures = 0
+  for vector in vectors:
+    lc_set, ap_set, result = alchemy._calculate_decimal(vector.seed)
+    rec = vector.recipes
+    failures += _check("alchemy.decimal", vector, "recipes",
+        [lc_set, ap_set, *result],
+        [rec.lc_set, rec.ap_set, rec.lc_recipe, rec.lc_prob,
+          rec.ap_recipe, rec.ap_prob])
+  return failures
+
+def verify_alchemy_batched(vectors):
+  "alchemy.calculate_many() via alchemy.RecipeEvaluator"
+  failures = 0
+  seeds = [vector.seed for vector in vectors]
+  for vector, record in zip(vectors, alchemy.calculate_many(seeds)):
+    failures += _check("alchemy.batched", vector, "recipes",
+        record, vector.recipes)
+  return failures
+
+def verify_alchemy_parallel(vectors):
+  "alchemy.scan_seeds() over the contiguous seeds"
+  failures = 0
+  expected = {vector.seed: vector for vector in vectors
+      if vector.seed <= CONTIGUOUS_SEEDS}
+  workers = min(4, os.cpu_count() or 1)
+  found = {}
+  for record in alchemy.scan_seeds(alchemy.RecipeFilter(),
+      start=1, stop=CONTIGUOUS_SEEDS + 1, workers=workers,
+      chunk_size=CONTIGUOUS_SEEDS // (workers * 2) or 1):
+    found[record.seed] = record
+  for seed, vector in sorted(expected.items()):
+    failures += _check("alchemy.parallel", vector, "recipes",
+        found.get(seed, ()), vector.recipes)
+  return failures
+
+BACKENDS = {
+  "rng.definition": verify_rng_definition,
+  "rng.scalar": verify_rng_scalar,
+  "rng.next_n": verify_rng_next_n,
+  "rng.skip": verify_rng_skip,
+  "rng.array": verify_rng_array,
+  "alchemy.scalar": verify_alchemy_scalar,
+  "alchemy.decimal": verify_alchemy_decimal,
+  "alchemy.batched": verify_alchemy_batched,
+  "alchemy.parallel": verify_alchemy_parallel
+}
+
+# 0}}}
+
+def available_backends():
+  "Get the names of the backends that can run here"
+  for name in BACKENDS:
+    if name == "rng.array" and not prng.HAVE_NUMPY:
+      continue
+    yield name
+
+def verify_corpus(path=GOLDEN_PATH, backends=None):
+  """
+  Verify the given backends (default: all available) against the corpus
+
+  Returns a dict of {backend: number of mismatches}.
+  """
+  vectors = load_corpus(path)
+  if backends is None:
+    backends = list(available_backends())
+  results = {}
+  for name in backends:
+    results[name] = BACKENDS[name](vectors)
+    logger.info("%s: %d mismatches", name, results[name])
+  return results
+
+def main():
+  "Entry point"
+  ap = argparse.ArgumentParser(
+      description="verify RNG and alchemy implementations against a corpus")
+  ap.add_argument("-c", "--corpus", metavar="PATH", default=GOLDEN_PATH,
+      help="corpus file (default: %(default)s)")
+  ap.add_argument("-b", "--backend", action="append", choices=BACKENDS,
+      help="verify only this backend (may be repeated)")
+  ap.add_argument("--generate", action="store_true",
+      help="regenerate the corpus using the reference implementation")
+  ap.add_argument("-v", "--verbose", action="store_true", help="verbose output")
+  args = ap.parse_args()
+  logging.basicConfig(format="%(module)s: %(levelname)s: %(message)s",
+      level=logging.DEBUG if args.verbose else logging.INFO, force=True)
+
+  if args.generate:
+    count = generate_corpus(args.corpus)
+    logger.info("Wrote %d vectors to %s", count, args.corpus)
+    return
+
+  results = verify_corpus(args.corpus, args.backend)
+  if any(results.values()):
+    logger.error("Verification failed: %s",
+        ", ".join(name for name, count in results.items() if count))
+    sys.exit(1)
+  logger.info("All %d backends match", len(results))
+
+if __name__ == "__main__":
+  main()
+
+# vim: set ts=2 sts=2 sw=2:
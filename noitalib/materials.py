@@ -58,6 +58,10 @@ AP_LC_ORGANICS = (
   "honey"
 )
 
+# Both of the above; AP/LC recipes are stored as indexes into this tuple
+AP_LC_MATERIALS = AP_LC_LIQUIDS + AP_LC_ORGANICS
+AP_LC_INDEX = {_name: _idx for _idx, _name in enumerate(AP_LC_MATERIALS)}
+
 MATERIAL_MAP = {
   "material_confusion": "mat_confusion",
   "material_darkness": "mat_darkness"
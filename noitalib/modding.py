@@ -32,6 +32,14 @@ def mod_get_compat(mod_path):
     logger.debug("Mod %s lacks compatibility file", mod_path)
     return {}
 
+def _extract_attrib(root):
+  "Get the attributes of the root node"
+  return dict(root.attrib)
+
+def _extract_mod_configs(root):
+  "Get the attributes of each <Mod> node, in order"
+  return [dict(mod_node.attrib) for mod_node in root.cssselect("Mod")]
+
 def get_mod(mod_path, native=False):
   """
   Get information encoding the given mod
@@ -42,7 +50,7 @@ def get_mod(mod_path, native=False):
   mod_num = os.path.dirname(mod_path)
   mod_id = mod_get_id(mod_path)
   modfile = os.path.join(mod_path, "mod.xml")
-  mod_info = xmltools.parse_xml(modfile, get_root=True).attrib
+  mod_info = xmltools.extract_xml(modfile, _extract_attrib)
   return {
     "id": mod_id,
     "path": modfile,
@@ -85,9 +93,9 @@ def save_get_mods(save_path):
       "extra": kwargs
     }
   conf_path = os.path.join(save_path, "mod_config.xml")
-  root = xmltools.parse_xml(conf_path, get_root=True)
-  for order, mod_node in enumerate(root.cssselect("Mod")):
-    mod = mod_def(**mod_node.attrib)
+  mod_configs = xmltools.extract_xml(conf_path, _extract_mod_configs)
+  for order, mod_attrib in enumerate(mod_configs):
+    mod = mod_def(**mod_attrib)
     mod["order"] = order + 1
     if not mod["extra"]: # remove "extra" if empty
       del mod["extra"]
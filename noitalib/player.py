@@ -2,6 +2,18 @@
 
 """
 Functions for deciphering the player.xml file
+
+Player interprets player.xml lazily: the root's components are indexed by
+tag once, and each section (position, damage model, inventory, etc.) is
+interpreted the first time one of its values is requested.
+
+Player.from_stream() instead streams the file, interpreting only the
+requested sections' components and discarding everything else (sprites,
+particle emitters, etc.) as it goes. This is much faster and uses far
+less memory when analyzing many player files:
+
+  player = Player.from_stream(path)
+  player = Player.from_stream(path, sections=("damages",))
 """
 
 # TODO: Separate quick inventory and full inventory
@@ -22,20 +34,57 @@ AIR_INITIAL = 7
 AIR_DAMAGE_INITIAL = 0.6
 HEART_SIZE = 25
 
-def make_attr_getter(attr):
-  "Build a simple wrapper function"
+# Tags of the components each section is interpreted from. Only the first
+# component is used, except for MULTI_SECTIONS.
+SECTION_TAGS = {
+  "transform": "_Transform",
+  "char_data": "CharacterDataComponent",
+  "damages": "DamageModelComponent",
+  "drug_effects": "DrugEffectComponent",
+  "ingestions": "MaterialInventoryComponent",
+  "status_effects": "StatusEffectDataComponent",
+  "wallet": "WalletComponent",
+  "entities": "Entity"
+}
+
+TAG_SECTIONS = {tag: section for section, tag in SECTION_TAGS.items()}
+
+# Sections interpreted from every one of their components
+MULTI_SECTIONS = ("ingestions", "entities")
+
+# Sections interpreted by Player.from_stream() by default
+STREAM_SECTIONS = ("transform", "damages", "status_effects", "wallet",
+    "entities")
+
+def make_attr_getter(attr, section=None):
+  "Build a simple wrapper function, interpreting the section first if given"
   def wrapper(self):
     "Simple wrapper function"
+    if section is not None:
+      self._load(section)
     return getattr(self, "_" + attr)
   wrapper.__name__ = attr
   return wrapper
 
+def index_components(root):
+  "Build a dict {tag: [element...]} of the root's children"
+  components = {}
+  for elem in root:
+    if isinstance(elem.tag, str): # skip comments
+      components.setdefault(elem.tag, []).append(elem)
+  return components
+
 class Player:
   "The Noita"
-  def __init__(self, file_path):
+  def __init__(self, file_path, parse=True):
     "See help(type(self))"
     self._path = file_path
-    self._root = parse_player(file_path)
+    self._root = None
+    self._components = {}
+    if parse:
+      self._root = parse_player(file_path)
+      self._components = index_components(self._root)
+    self._loaded = set()
     self._xpos = None
     self._ypos = None
     self._rot = None
@@ -68,43 +117,93 @@ class Player:
     self._char_data = None
     self._physics = None
     self._damages = None
-    self._drug_effects = None
+    self._drug_effects = {}
     self._logging = None
     self._stats = None
     self._genome_info = None
-    self._interpret()
+
+  @classmethod
+  def from_stream(cls, file_path, sections=STREAM_SECTIONS):
+    """
+    Create a Player by streaming the file and interpreting only the given
+    sections (see SECTION_TAGS). Other sections keep their defaults.
+    """
+    player = cls(file_path, parse=False)
+    tags = {SECTION_TAGS[section] for section in sections}
+    seen = set()
+    for elem in xmltools.iter_children(file_path, tags):
+      section = TAG_SECTIONS[elem.tag]
+      if section in seen and section not in MULTI_SECTIONS:
+        continue
+      seen.add(section)
+      player._interpret_component(section, elem)
+    player._loaded.update(SECTION_TAGS)
+    return player
 
   def pos(self):
     "Get the player coordinates"
+    self._load("transform")
     return (self._xpos, self._ypos)
 
-  health = property(make_attr_getter("health"))
-  max_health = property(make_attr_getter("max_health"))
-  blood_material = property(make_attr_getter("blood_material"))
-  blood_spray_material = property(make_attr_getter("blood_spray_material"))
-  blood_multiplier = property(make_attr_getter("blood_multiplier"))
-  air = property(make_attr_getter("air"))
-  air_max = property(make_attr_getter("air_max"))
-  drowning_damage = property(make_attr_getter("drowning_damage"))
-  material_damages = property(make_attr_getter("material_damages"))
-  damage_multipliers = property(make_attr_getter("damage_multipliers"))
-  status_effects = make_attr_getter("status_effects")
-  ingestions = make_attr_getter("ingestions")
-  wands = property(make_attr_getter("wands"))
-  items = property(make_attr_getter("items"))
-  spells = property(make_attr_getter("spells"))
-
-  damages = property(make_attr_getter("damages"))
-  drug_effects = property(make_attr_getter("drug_effects"))
+  health = property(make_attr_getter("health", "damages"))
+  max_health = property(make_attr_getter("max_health", "damages"))
+  blood_material = property(make_attr_getter("blood_material", "damages"))
+  blood_spray_material = property(
+      make_attr_getter("blood_spray_material", "damages"))
+  blood_multiplier = property(make_attr_getter("blood_multiplier", "damages"))
+  air = property(make_attr_getter("air", "damages"))
+  air_max = property(make_attr_getter("air_max", "damages"))
+  drowning_damage = property(make_attr_getter("drowning_damage", "damages"))
+  material_damages = property(make_attr_getter("material_damages", "damages"))
+  damage_multipliers = property(
+      make_attr_getter("damage_multipliers", "damages"))
+  status_effects = make_attr_getter("status_effects", "status_effects")
+  ingestions = make_attr_getter("ingestions", "ingestions")
+  wands = property(make_attr_getter("wands", "entities"))
+  items = property(make_attr_getter("items", "entities"))
+  spells = property(make_attr_getter("spells", "entities"))
+  money = property(make_attr_getter("money", "wallet"))
+  money_spent = property(make_attr_getter("money_spent", "wallet"))
+  money_inf = property(make_attr_getter("money_inf", "wallet"))
+
+  damages = property(make_attr_getter("damages", "damages"))
+  drug_effects = property(make_attr_getter("drug_effects", "drug_effects"))
+
+  def _load(self, section):
+    "Interpret the named section, unless it has already been interpreted"
+    if section in self._loaded:
+      return
+    logger.trace("Interpreting player section %s", section)
+    # Mark the section first: if interpreting it fails partway, it must
+    # not be interpreted again, which would append duplicate entries
+    self._loaded.add(section)
+    elems = self._components.get(SECTION_TAGS[section], ())
+    if not elems:
+      logger.debug("Player %s lacks %s", self._path, SECTION_TAGS[section])
+    if section not in MULTI_SECTIONS:
+      elems = elems[:1]
+    for elem in elems:
+      self._interpret_component(section, elem)
+
+  def _interpret_component(self, section, elem):
+    "Interpret a single component belonging to the named section"
+    if section == "ingestions":
+      tags = elem.attrib.get("_tags", "").split(",")
+      if "ingestion" in tags:
+        self._interpret_ingestions(elem, override=False)
+    elif section == "entities":
+      self._interpret_entities((elem,))
+    else:
+      getattr(self, "_interpret_" + section)(elem)
 
   def _interpret(self):
-    "Extract information from self._root"
-    self._interpret_transform(self._root.find("_Transform"))
+    "Interpret every section now rather than on demand"
+    self._load("transform")
     # TODO: Audio
-    self._interpret_char_data(self._root.find("CharacterDataComponent"))
+    self._load("char_data")
     # TODO: CharacterPlatformingComponent
-    self._interpret_damages(self._root.find("DamageModelComponent"))
-    self._interpret_drug_effects(self._root.find("DrugEffectComponent"))
+    self._load("damages")
+    self._load("drug_effects")
     # TODO: GameLogComponent and GameStatesComponent
     # TODO: GunComponent
     # TODO: HitboxComponent
@@ -115,10 +214,7 @@ class Player:
     # TODO: LightComponent
     # TODO: LiquidDisplacerComponent
     # TODO: LuaComponents
-    for elem in self._root.findall("MaterialInventoryComponent"):
-      tags = elem.attrib.get("_tags", "").split(",")
-      if "ingestion" in tags:
-        self._interpret_ingestions(elem, override=False)
+    self._load("ingestions")
     # TODO: MaterialSuckerComponent
     # TODO: ParticleEmitterComponent
     # TODO: PathFindingGridMarkerComponent
@@ -128,14 +224,18 @@ class Player:
     # TODO: SpriteAnimatorComponent and SpriteComponents
     # TODO: SpriteParticleEmitterComponent
     # TODO: SpriteStainsComponent
-    self._interpret_status_effects(self._root.find("StatusEffectDataComponent"))
+    self._load("status_effects")
     # TODO: StreamingKeepAliveComponent
     # TODO: VariableStorageComponents
     # TODO: VelocityComponent
-    self._interpret_wallet(self._root.find("WalletComponent"))
-    for elem in self._root.findall("Entity"):
+    self._load("wallet")
+    self._load("entities")
+
+  def _interpret_entities(self, elems):
+    "Interpret the child <Entity> nodes"
+    for elem in elems:
       name = elem.attrib.get("name")
-      tags = elem.attrib.get("tags")
+      tags = elem.attrib.get("tags", "")
       if name == "arm_r":
         logger.debug("Parsing arm_r %r", elem)
       elif name == "cape":
@@ -172,11 +272,11 @@ class Player:
 
   def _interpret_char_data(self, elem):
     "Interpret the <CharacterDataComponent> node"
-    self._char_data = elem.attrib # TODO
+    self._char_data = dict(elem.attrib) # TODO
 
   def _interpret_platforming(self, elem):
     "Interpret the <CharacterPlatformingComponent> node"
-    self._physics = elem.attrib # TODO
+    self._physics = dict(elem.attrib) # TODO
 
   def _interpret_damages(self, elem):
     "Interpret the <DamageModelComponent> node"
@@ -201,7 +301,7 @@ class Player:
     mult_elem = elem.find("damage_multipliers")
     for dmg_kind, dmg_mult in mult_elem.attrib.items():
       self._damage_multipliers[dmg_kind] = float(dmg_mult)
-    self._damages = elem.attrib
+    self._damages = dict(elem.attrib)
 
   def _interpret_ingestions(self, elem, override=True):
     "Interpret the <MaterialInventoryComponent _tags='ingestion'> node"
@@ -227,7 +327,7 @@ class Player:
     status_values = zip(stains, effects_prev, ingestion, causes_many)
     for cause, values in zip(causes, status_values):
       if cause != "air" or any(val != "0" for val in values):
-        self._status_effects[cause] = zip(labels, values)
+        self._status_effects[cause] = dict(zip(labels, values))
 
   def _interpret_inventory(self, elem, quick):
     "Interpret an inventory node"
@@ -263,19 +363,19 @@ class Player:
   def _interpret_drug_effects(self, elem):
     "Intrepret the <DrugEffectComponent> node"
     logger.trace("Parsing drug effects %r: %r", elem, elem.attrib)
-    self._drug_effects = elem.attrib # TODO
+    self._drug_effects = dict(elem.attrib) # TODO
 
   def _interpret_game_log(self, elem):
     "Interpret the <GameLogComponent> node"
-    self._logging = elem.attrib # TODO
+    self._logging = dict(elem.attrib) # TODO
 
   def _interpret_stats(self, elem):
     "Interpret the <GameStatsComponent> node"
-    self._stats = elem.attrib # TODO
+    self._stats = dict(elem.attrib) # TODO
 
   def _interpret_genome(self, elem):
     "Interpret the <GenomeDataComponent> node"
-    self._genome_info = elem.attrib # TODO
+    self._genome_info = dict(elem.attrib) # TODO
 
   def _interpret_wallet(self, elem):
     "Interpret the <WalletComponent> node"
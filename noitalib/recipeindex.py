@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+"""
+On-disk index mapping AP/LC recipes to the world seeds that produce them
+
+An index is a directory holding one file per recipe kind ("lc.idx" and
+"ap.idx"). Each file is a fixed-size header followed by fixed-width,
+sorted records:
+  byte 0-2  material indexes into materials.AP_LC_MATERIALS, ascending
+  byte 3    recipe probability
+  byte 4-7  world seed, big-endian
+Because every field is big-endian, sorting the raw records sorts them by
+(materials, probability, seed), so a query is a binary search over the
+memory-mapped file.
+
+Building computes sorted runs for each chunk of seeds in parallel, then
+merges the runs into the final files. Completed runs are kept until the
+merge, so an interrupted build resumes where it left off. Runs are named
+by the [start, stop) range they cover; runs left over from a build with a
+different range or chunk size are ignored and removed.
+
+  python -m noitalib.recipeindex build INDEX 1 1000000
+  python -m noitalib.recipeindex query INDEX --ap lava --ap water --ap sand
+"""
+
+import argparse
+import functools
+import heapq
+import logging
+import mmap
+import multiprocessing
+import os
+import shutil
+import struct
+
+import utility.loghelper
+from noitalib import alchemy
+from noitalib import materials
+logger = utility.loghelper.DelayLogger(__name__)
+
+KIND_LC = "lc"
+KIND_AP = "ap"
+KINDS = (KIND_LC, KIND_AP)
+
+INDEX_MAGIC = b"NOITARIX"
+INDEX_VERSION = 1
+# magic, version, padding, first seed, last seed + 1
+HEADER = struct.Struct(">8sI4xQQ")
+RECORD = struct.Struct(">4sI")
+
+BUILD_CHUNK_SIZE = 1000000
+RUNS_DIR = "runs"
+READ_SIZE = RECORD.size * 1024
+
+def index_file(path, kind):
+  "Get the path to the index file for the given recipe kind"
+  return os.path.join(path, f"{kind}{os.extsep}idx")
+
+def encode_recipe(recipe, probability=None):
+  "Encode a recipe (and optionally its probability) as a key prefix"
+  key = bytes(sorted(materials.AP_LC_INDEX[mat] for mat in recipe))
+  if len(key) != 3:
+    raise ValueError(f"Recipe {recipe!r} must have exactly three materials")
+  if probability is not None:
+    key += bytes((probability,))
+  return key
+
+def decode_key(key):
+  "Decode a record key into (materials, probability)"
+  mats = tuple(materials.AP_LC_MATERIALS[idx] for idx in key[:3])
+  return mats, key[3]
+
+def _run_file(runs_path, kind, start, stop):
+  "Get the path to the run of the given kind covering [start, stop)"
+  return os.path.join(runs_path, f"{kind}-{start:010d}-{stop:010d}")
+
+def _run_complete(run_path, start, stop):
+  "True if the run file exists and holds a record for every seed"
+  try:
+    return os.path.getsize(run_path) == (stop - start) * RECORD.size
+  except FileNotFoundError:
+    return False
+
+def _build_chunk(runs_path, bounds):
+  "Write sorted LC and AP runs for one [start, stop) chunk of seeds"
+  start, stop = bounds
+  run_paths = {kind: _run_file(runs_path, kind, start, stop)
+      for kind in KINDS}
+  if all(_run_complete(run_path, start, stop)
+      for run_path in run_paths.values()):
+    return bounds
+  records = {KIND_LC: [], KIND_AP: []}
+  evaluator = alchemy.RecipeEvaluator()
+  for seed in range(start, stop):
+    lc_recipe, lc_prob, ap_recipe, ap_prob = evaluator.evaluate(seed)
+    lc_key = bytes(sorted(lc_recipe)) + bytes((lc_prob,))
+    ap_key = bytes(sorted(ap_recipe)) + bytes((ap_prob,))
+    records[KIND_LC].append(RECORD.pack(lc_key, seed))
+    records[KIND_AP].append(RECORD.pack(ap_key, seed))
+  for kind, run_path in run_paths.items():
+    records[kind].sort()
+    temp_path = run_path + os.extsep + "tmp"
+    with open(temp_path, "wb") as fobj:
+      fobj.write(b"".join(records[kind]))
+    os.replace(temp_path, run_path)
+  return bounds
+
+def _iter_run(run_path):
+  "Yield the raw records stored in a run file"
+  with open(run_path, "rb") as fobj:
+    while True:
+      block = fobj.read(READ_SIZE)
+      if not block:
+        break
+      for offset in range(0, len(block), RECORD.size):
+        yield block[offset:offset+RECORD.size]
+
+def _merge_runs(run_paths, out_path, start, stop):
+  "Merge sorted run files into a single index file"
+  temp_path = out_path + os.extsep + "tmp"
+  with open(temp_path, "wb") as fobj:
+    fobj.write(HEADER.pack(INDEX_MAGIC, INDEX_VERSION, start, stop))
+    fobj.writelines(heapq.merge(*(_iter_run(rpath) for rpath in run_paths)))
+  os.replace(temp_path, out_path)
+
+def build_index(path, start=alchemy.SEED_MIN, stop=alchemy.SEED_MAX + 1,
+    workers=None, chunk_size=BUILD_CHUNK_SIZE):
+  """
+  Build a recipe index for the seeds in [start, stop) in the given directory
+
+  Chunks of chunk_size seeds are computed by workers processes (default:
+  all cores). Each chunk uses roughly 100 bytes of memory per seed.
+  """
+  runs_path = os.path.join(path, RUNS_DIR)
+  os.makedirs(runs_path, exist_ok=True)
+  chunks = [(low, min(low + chunk_size, stop))
+      for low in range(start, stop, chunk_size)]
+  expected = {os.path.basename(_run_file(runs_path, kind, low, high))
+      for kind in KINDS for low, high in chunks}
+  for entry in os.listdir(runs_path):
+    if entry not in expected:
+      logger.warning("Removing stale run %s", entry)
+      os.unlink(os.path.join(runs_path, entry))
+  with multiprocessing.Pool(workers) as pool:
+    build_func = functools.partial(_build_chunk, runs_path)
+    for num_done, bounds in enumerate(pool.imap_unordered(build_func, chunks)):
+      logger.info("Built chunk %d-%d (%d of %d)",
+          bounds[0], bounds[1] - 1, num_done + 1, len(chunks))
+  for kind in KINDS:
+    run_paths = [_run_file(runs_path, kind, low, high)
+        for low, high in chunks]
+    logger.info("Merging %d %s runs", len(run_paths), kind)
+    _merge_runs(run_paths, index_file(path, kind), start, stop)
+  shutil.rmtree(runs_path)
+
+class RecipeIndex:
+  "Read-only view of an index created by build_index()"
+  def __init__(self, path):
+    "See help(type(self))"
+    self._path = path
+    self._maps = {}
+    self._range = None
+    for kind in KINDS:
+      with open(index_file(path, kind), "rb") as fobj:
+        fmap = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+      magic, version, start, stop = HEADER.unpack_from(fmap)
+      if magic != INDEX_MAGIC or version != INDEX_VERSION:
+        raise ValueError(f"{index_file(path, kind)!r} is not a recipe index")
+      self._maps[kind] = fmap
+      self._range = (start, stop)
+
+  def __enter__(self):
+    "Context manager entry"
+    return self
+
+  def __exit__(self, *args):
+    "Context manager exit"
+    self.close()
+
+  def close(self):
+    "Release the memory maps"
+    for fmap in self._maps.values():
+      fmap.close()
+    self._maps = {}
+
+  @property
+  def seed_range(self):
+    "The [start, stop) range of seeds covered by this index"
+    return self._range
+
+  def __len__(self):
+    "Number of seeds in the index"
+    return (len(self._maps[KIND_LC]) - HEADER.size) // RECORD.size
+
+  def _bisect(self, fmap, prefix, upper):
+    "Find the first record whose key prefix is >= (or > if upper) prefix"
+    size = len(prefix)
+    low = 0
+    high = (len(fmap) - HEADER.size) // RECORD.size
+    while low < high:
+      mid = (low + high) // 2
+      offset = HEADER.size + mid * RECORD.size
+      key = fmap[offset:offset+size]
+      if key < prefix or (upper and key == prefix):
+        low = mid + 1
+      else:
+        high = mid
+    return low
+
+  def _range_of(self, kind, prefix):
+    "Get the (first, last + 1) record numbers matching the key prefix"
+    fmap = self._maps[kind]
+    return self._bisect(fmap, prefix, False), self._bisect(fmap, prefix, True)
+
+  def count(self, kind, recipe, probability=None):
+    "Count the seeds whose recipe of the given kind matches"
+    first, last = self._range_of(kind, encode_recipe(recipe, probability))
+    return last - first
+
+  def lookup(self, kind, recipe, probability=None):
+    """
+    Get a list of (seed, probability) pairs for the seeds whose recipe of
+    the given kind consists of the given materials (in any order),
+    optionally restricted to a specific probability
+    """
+    first, last = self._range_of(kind, encode_recipe(recipe, probability))
+    start = HEADER.size + first * RECORD.size
+    stop = HEADER.size + last * RECORD.size
+    data = self._maps[kind][start:stop]
+    return [(seed, key[3]) for key, seed in RECORD.iter_unpack(data)]
+
+  def seeds(self, kind, recipe, probability=None):
+    "Get the sorted seeds whose recipe of the given kind matches"
+    return sorted(seed for seed, _ in self.lookup(kind, recipe, probability))
+
+def main():
+  "Entry point"
+  ap = argparse.ArgumentParser(
+      description="build and query an on-disk AP/LC recipe index")
+  sp = ap.add_subparsers(dest="action", required=True)
+  bp = sp.add_parser("build", help="build an index")
+  bp.add_argument("path", help="index directory")
+  bp.add_argument("start", type=int, help="first seed")
+  bp.add_argument("stop", type=int, help="last seed (inclusive)")
+  bp.add_argument("-j", "--jobs", type=int, metavar="NUM",
+      help="number of worker processes (default: all cores)")
+  bp.add_argument("--chunk-size", type=int, metavar="NUM",
+      default=BUILD_CHUNK_SIZE,
+      help="seeds per work unit (default: %(default)s)")
+  qp = sp.add_parser("query", help="query an index")
+  qp.add_argument("path", help="index directory")
+  mg = qp.add_mutually_exclusive_group(required=True)
+  mg.add_argument("--lc", metavar="MAT", action="append",
+      help="LC recipe material (give exactly three)")
+  mg.add_argument("--ap", metavar="MAT", action="append",
+      help="AP recipe material (give exactly three)")
+  qp.add_argument("--prob", type=int, metavar="NUM",
+      help="require the recipe probability to be %(metavar)s")
+  qp.add_argument("-c", "--count", action="store_true",
+      help="display only the number of matching seeds")
+  ap.add_argument("-v", "--verbose", action="store_true", help="verbose output")
+  args = ap.parse_args()
+  logging.basicConfig(format="%(module)s: %(levelname)s: %(message)s",
+      level=logging.DEBUG if args.verbose else logging.INFO, force=True)
+
+  if args.action == "build":
+    build_index(args.path, args.start, args.stop + 1,
+        workers=args.jobs, chunk_size=args.chunk_size)
+  else:
+    kind, recipe = (KIND_LC, args.lc) if args.lc else (KIND_AP, args.ap)
+    for mat in recipe:
+      if mat not in materials.AP_LC_INDEX:
+        ap.error(f"unknown material {mat!r}")
+    if len(recipe) != 3:
+      ap.error("recipes consist of exactly three materials")
+    with RecipeIndex(args.path) as index:
+      if args.count:
+        print(index.count(kind, recipe, args.prob))
+      else:
+        for seed, prob in index.lookup(kind, recipe, args.prob):
+          print(f"{seed} {prob}%")
+
+if __name__ == "__main__":
+  main()
+
+# vim: set ts=2 sts=2 sw=2:
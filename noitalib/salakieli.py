@@ -6,16 +6,31 @@ Functions and constants for encrypting and decrypting Noita data
 All salakieli files are encrypted with AES-128-CTR using particular key
 and IV (initialization vector) pairs defined below. This module wraps
 the encryption and decryption details into convenient functions.
-"""
 
-# TODO: encryption
+decrypt_file() and decrypt_data() return the whole plaintext as a
+string. For large files, iter_decrypt_file() decrypts a memory-mapped
+file in fixed-size chunks into a single reusable buffer and
+parse_file() feeds those chunks straight into an incremental XML
+parser, so peak memory does not depend on the size of the file.
+decrypt_many() decrypts a batch of files using a thread pool; the
+cryptography backend releases the GIL while decrypting.
+
+encrypt_data() and encrypt_file() perform the reverse. decrypt_tree()
+and encrypt_tree() convert every salakieli file under a directory (such
+as a save directory) to and from plaintext copies named "X.salakieli.xml"
+in parallel, replacing files atomically.
+"""
 
 import binascii
+import concurrent.futures
+import functools
+import mmap
 import os
 import pathlib
 
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
+import lxml.etree as et
 
 import utility.loghelper
 from . import sessions
@@ -23,8 +38,12 @@ from . import xmltools
 logger = utility.loghelper.DelayLogger(__name__)
 
 KEY_LEN = 16 # Only the first 16 bytes matter
+BLOCK_LEN = 16 # AES block size in bytes
+CHUNK_SIZE = 64 * 1024 # Bytes decrypted at a time when streaming
+CIPHER_CACHE_SIZE = 32 # Number of prepared key/IV pairs to keep
 
 EXT = "salakieli"
+PLAIN_EXT = "xml" # Appended to decrypted copies: X.salakieli.xml
 
 KIV_PLAYER = "player"
 KIV_WORLD = "world_state"
@@ -50,14 +69,24 @@ KEY_IV_MAP = {
     "ThreeEyesAreWatchingYou"),
 }
 
-def guess_kiv_pair(fname):
+def guess_kiv_name(fname):
   """
-  Guess which key and IV pair to use for the given filename.
+  Guess which KIV_* constant applies to the given filename. Returns None
+  if the file is not a known salakieli file.
   """
   fbase, fext = os.path.splitext(fname)
   if fext.lstrip(os.extsep) == EXT:
     if fbase in KEY_IV_MAP:
-      return KEY_IV_MAP[fbase]
+      return fbase
+  return None
+
+def guess_kiv_pair(fname):
+  """
+  Guess which key and IV pair to use for the given filename.
+  """
+  kiv_name = guess_kiv_name(fname)
+  if kiv_name is not None:
+    return KEY_IV_MAP[kiv_name]
   logger.warning("Unable to determine key/IV pair for %r", fname)
   return ("", "")
 
@@ -71,6 +100,56 @@ def kiv_to_bin(file_key, file_iv):
     file_iv = file_iv.encode("ascii")
   return file_key[:KEY_LEN], file_iv[:KEY_LEN]
 
+def _get_kiv(fpath, kiv_name):
+  """
+  Get the KIV_* constant for the given file, if not given explicitly.
+  Falls back to an empty key and IV pair if it cannot be determined.
+  """
+  if kiv_name is None:
+    kiv_name = guess_kiv_name(os.path.basename(fpath))
+  if kiv_name is None:
+    return guess_kiv_pair(os.path.basename(fpath))
+  return kiv_name
+
+@functools.lru_cache(maxsize=CIPHER_CACHE_SIZE)
+def _new_cipher(kiv_pair):
+  """
+  Get a Cipher for a KIV_* constant or a pair of binary strings
+
+  Ciphers are immutable and each call to decryptor() or encryptor()
+  creates an independent context, so the prepared key material is cached
+  and shared between calls and threads.
+  """
+  if kiv_pair in KEY_IV_MAP:
+    data_key, data_iv = kiv_to_bin(*KEY_IV_MAP[kiv_pair])
+  else:
+    data_key, data_iv = kiv_to_bin(*kiv_pair)
+
+  if not data_key or not data_iv:
+    raise ValueError(f"Failed to determine key and/or IV for {kiv_pair!r}")
+
+  return Cipher(algorithms.AES(data_key), modes.CTR(data_iv),
+      backend=default_backend())
+
+def _new_decryptor(kiv_pair):
+  "Create a decryptor for a KIV_* constant or a pair of binary strings"
+  return _new_cipher(kiv_pair).decryptor()
+
+def _new_encryptor(kiv_pair):
+  "Create an encryptor for a KIV_* constant or a pair of binary strings"
+  return _new_cipher(kiv_pair).encryptor()
+
+def _write_atomic(fpath, fdata):
+  "Write binary data to a file such that readers never see a partial file"
+  temp_path = fpath + os.extsep + "tmp"
+  try:
+    with open(temp_path, "wb") as fobj:
+      fobj.write(fdata)
+    os.replace(temp_path, fpath)
+  finally:
+    if os.path.exists(temp_path):
+      os.remove(temp_path)
+
 def decrypt_file(fpath, kiv_name=None):
   """
   Open and decrypt the given file.
@@ -79,15 +158,22 @@ def decrypt_file(fpath, kiv_name=None):
   Otherwise, this function will determine the constants using the
   filename.
   """
-  fname = os.path.basename(fpath)
-  if kiv_name is None:
-    file_key, file_iv = guess_kiv_pair(fname)
-  else:
-    file_key, file_iv = KEY_IV_MAP[kiv_name]
-  hex_key, hex_iv = kiv_to_bin(file_key, file_iv)
+  kiv_pair = _get_kiv(fpath, kiv_name)
   with open(fpath, "rb") as fobj:
     fdata = fobj.read()
-  return decrypt_data(fdata, (hex_key, hex_iv))
+  return decrypt_data(fdata, kiv_pair)
+
+def decrypt_many(fpaths, workers=None, kiv_name=None):
+  """
+  Decrypt the given files using up to workers threads.
+
+  Returns the decrypted strings in the same order as the paths. As with
+  decrypt_file(), the KIV_* constant is determined from each filename
+  unless one is given.
+  """
+  func = functools.partial(decrypt_file, kiv_name=kiv_name)
+  with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+    return list(pool.map(func, fpaths))
 
 def decrypt_data(fdata, kiv_pair):
   """
@@ -96,18 +182,131 @@ def decrypt_data(fdata, kiv_pair):
   The key and IV can be specified via either a KIV_* constant or a pair
   of binary strings.
   """
-  if kiv_pair in KEY_IV_MAP:
-    data_key, data_iv = kiv_to_bin(*KEY_IV_MAP[kiv_pair])
-  else:
-    data_key, data_iv = kiv_to_bin(*kiv_pair)
-
-  if not data_key or not data_iv:
-    raise ValueError(f"Failed to determine key and/or IV for {fpath!r}")
-
-  cipher = Cipher(algorithms.AES(data_key), modes.CTR(data_iv),
-      backend=default_backend())
-  decryptor = cipher.decryptor()
+  decryptor = _new_decryptor(kiv_pair)
   decrypted = decryptor.update(fdata) + decryptor.finalize()
   return decrypted.decode()
 
+def encrypt_data(fdata, kiv_pair):
+  """
+  Encrypt the given string or binary string.
+
+  The key and IV can be specified via either a KIV_* constant or a pair
+  of binary strings.
+  """
+  if isinstance(fdata, str):
+    fdata = fdata.encode()
+  encryptor = _new_encryptor(kiv_pair)
+  return encryptor.update(fdata) + encryptor.finalize()
+
+def encrypt_file(fpath, fdata, kiv_name=None):
+  """
+  Encrypt the given data and atomically write it to the given file.
+
+  As with decrypt_file(), the key and IV are determined from the filename
+  unless a KIV_* constant is passed.
+  """
+  _write_atomic(fpath, encrypt_data(fdata, _get_kiv(fpath, kiv_name)))
+
+def iter_decrypt_file(fpath, kiv_name=None, chunk_size=CHUNK_SIZE):
+  """
+  Decrypt the given file in chunks, yielding each decrypted chunk.
+
+  The file is memory-mapped and every chunk is decrypted into the same
+  buffer, so each yielded memoryview is only valid until the next one
+  is requested. Copy it (e.g. with bytes()) to keep it. Chunks are raw
+  bytes; a multi-byte character may span two chunks.
+  """
+  decryptor = _new_decryptor(_get_kiv(fpath, kiv_name))
+  buffer = bytearray(chunk_size + BLOCK_LEN - 1)
+  view = memoryview(buffer)
+  with open(fpath, "rb") as fobj:
+    if os.fstat(fobj.fileno()).st_size == 0:
+      return
+    with mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ) as fmap:
+      fview = memoryview(fmap)
+      try:
+        for offset in range(0, len(fmap), chunk_size):
+          nbytes = decryptor.update_into(
+              fview[offset:offset+chunk_size], buffer)
+          yield view[:nbytes]
+      finally:
+        fview.release()
+  # CTR is a stream mode; finalize() never produces additional data
+  decryptor.finalize()
+
+def parse_file(fpath, kiv_name=None, parser=None, chunk_size=CHUNK_SIZE):
+  """
+  Decrypt and parse the given XML file, returning the root element.
+
+  The plaintext is fed to the parser as it is decrypted and is never
+  held in memory as a whole. Pass an lxml.etree.XMLParser to control
+  parsing options (or to use a parser with a custom target); otherwise
+  a default one is used.
+  """
+  if parser is None:
+    parser = et.XMLParser()
+  for chunk in iter_decrypt_file(fpath, kiv_name, chunk_size):
+    parser.feed(bytes(chunk))
+  return parser.close()
+
+def plain_path(fpath):
+  "Get the path of the decrypted copy of the given salakieli file"
+  return fpath + os.extsep + PLAIN_EXT
+
+def find_files(root_path, plain=False):
+  """
+  Find all known salakieli files under the given directory. If plain is
+  True, find their decrypted copies instead.
+  """
+  for dir_path, _, file_names in os.walk(root_path):
+    for fname in sorted(file_names):
+      if plain:
+        fbase, fext = os.path.splitext(fname)
+        if fext.lstrip(os.extsep) == PLAIN_EXT and guess_kiv_name(fbase):
+          yield os.path.join(dir_path, fname)
+      elif guess_kiv_name(fname):
+        yield os.path.join(dir_path, fname)
+
+def _decrypt_to_plain(fpath):
+  "Decrypt a salakieli file to its plaintext copy; returns the new path"
+  with open(fpath, "rb") as fobj:
+    fdata = fobj.read()
+  decryptor = _new_decryptor(_get_kiv(fpath, None))
+  out_path = plain_path(fpath)
+  _write_atomic(out_path, decryptor.update(fdata) + decryptor.finalize())
+  return out_path
+
+def _encrypt_from_plain(fpath):
+  "Encrypt a plaintext copy back to its salakieli file; returns the new path"
+  out_path = os.path.splitext(fpath)[0]
+  with open(fpath, "rb") as fobj:
+    fdata = fobj.read()
+  encrypt_file(out_path, fdata)
+  return out_path
+
+def _convert_tree(func, paths, workers):
+  "Apply func to each path using a thread pool; returns the output paths"
+  results = []
+  with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+    for in_path, out_path in zip(paths, pool.map(func, paths)):
+      logger.debug("Wrote %s from %s", out_path, in_path)
+      results.append(out_path)
+  return results
+
+def decrypt_tree(root_path, workers=None):
+  """
+  Decrypt every salakieli file X under the given directory to X.xml,
+  using up to workers threads. Returns the paths written.
+  """
+  return _convert_tree(_decrypt_to_plain, list(find_files(root_path)), workers)
+
+def encrypt_tree(root_path, workers=None):
+  """
+  Encrypt every decrypted copy X.xml under the given directory back to
+  the salakieli file X, using up to workers threads. Returns the paths
+  written.
+  """
+  paths = list(find_files(root_path, plain=True))
+  return _convert_tree(_encrypt_from_plain, paths, workers)
+
 # vim: set ts=2 sts=2 sw=2:
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+"""
+Persistent SQLite index of parsed Noita play sessions
+
+Parsing every stats.xml and kills.xml file on each run is slow for large
+session archives. A SessionIndex stores the parsed sessions keyed by the
+stats file path along with the modification time and size of both files.
+update() parses only new or changed sessions (and drops deleted ones),
+and the "last", "today", date prefix and seed filters accepted by
+noita.py become indexed queries:
+
+  with SessionIndex(path) as index:
+    index.update(save_dir)
+    for session in index.sessions(save_dir, "last"):
+      ...
+
+Sessions read from the index have the same keys as those returned by
+sessions.parse_session(), except that "_nodes" is always None.
+
+table() returns an aggregate.SessionTable of a save's sessions. The table
+is cached in the index until the save's sessions change.
+"""
+
+import datetime
+import json
+import os
+import sqlite3
+
+import utility.loghelper
+from . import aggregate
+from . import constants
+from . import sessions
+logger = utility.loghelper.DelayLogger(__name__)
+
+INDEX_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+  stats_file TEXT PRIMARY KEY,
+  save_dir TEXT NOT NULL,
+  name TEXT NOT NULL,
+  stats_mtime INTEGER NOT NULL,
+  stats_size INTEGER NOT NULL,
+  kills_mtime INTEGER,
+  kills_size INTEGER,
+  timestamp REAL,
+  seed TEXT,
+  build TEXT,
+  kill_count INTEGER,
+  death_count INTEGER,
+  data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_by_name ON sessions (save_dir, name);
+CREATE INDEX IF NOT EXISTS sessions_by_seed ON sessions (save_dir, seed);
+CREATE TABLE IF NOT EXISTS tables (
+  save_dir TEXT PRIMARY KEY,
+  data BLOB NOT NULL
+);
+"""
+
+# Columns for a session's stats and kills file signatures
+SIGNATURE_COLUMNS = "stats_mtime, stats_size, kills_mtime, kills_size"
+
+def _file_signature(fpath):
+  "Get the (mtime, size) of a file, or (None, None) if it does not exist"
+  try:
+    fstat = os.stat(fpath)
+  except FileNotFoundError:
+    return None, None
+  return fstat.st_mtime_ns, fstat.st_size
+
+def _glob_escape(term):
+  "Escape a string for use within an SQLite GLOB pattern"
+  return "".join(f"[{char}]" if char in "*?[" else char for char in term)
+
+class SessionIndex:
+  "SQLite-backed index of parsed sessions"
+  def __init__(self, path):
+    "See help(type(self))"
+    self._path = path
+    self._conn = sqlite3.connect(path)
+    version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+    if version not in (0, INDEX_VERSION):
+      self._conn.close()
+      raise ValueError(f"{path!r} has unsupported index version {version}")
+    with self._conn:
+      self._conn.executescript(SCHEMA)
+      self._conn.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+
+  def __enter__(self):
+    "Context manager entry"
+    return self
+
+  def __exit__(self, *args):
+    "Context manager exit"
+    self.close()
+
+  def close(self):
+    "Close the database"
+    self._conn.close()
+
+  def __len__(self):
+    "Number of sessions in the index"
+    return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+  def update(self, save_dir, workers=None):
+    """
+    Bring the index up to date with the session files in the given save
+
+    New and changed sessions are parsed using up to workers processes; see
+    sessions.parse_sessions(). Returns a pair (number of sessions parsed,
+    number of sessions removed).
+    """
+    known = {}
+    query = f"SELECT stats_file, {SIGNATURE_COLUMNS} FROM sessions " \
+        "WHERE save_dir = ?"
+    for stats_file, *signature in self._conn.execute(query, (save_dir,)):
+      known[stats_file] = tuple(signature)
+
+    changed = {}
+    for stats_file in sessions.get_stats_files(save_dir):
+      kills_file = sessions.get_kills_file(stats_file)
+      signature = _file_signature(stats_file) + _file_signature(kills_file)
+      if known.pop(stats_file, None) != signature:
+        logger.debug("Indexing session %s", stats_file)
+        changed[stats_file] = signature
+
+    with self._conn:
+      parsed = sessions.parse_sessions(changed, workers)
+      for (stats_file, signature), session in zip(changed.items(), parsed):
+        self._store(save_dir, session, signature)
+      self._conn.executemany("DELETE FROM sessions WHERE stats_file = ?",
+          ((stats_file,) for stats_file in known))
+      if changed or known:
+        self._conn.execute("DELETE FROM tables WHERE save_dir = ?",
+            (save_dir,))
+    logger.debug("Indexed %d and removed %d sessions in %s",
+        len(changed), len(known), save_dir)
+    return len(changed), len(known)
+
+  def _store(self, save_dir, session, signature):
+    "Insert or replace a single parsed session"
+    stats_file = session["_files"]["stats_file"]
+    kills = session["kills"]
+    data = {
+      "stats": session["stats"],
+      "stats_text": session.get("stats_text"),
+      "biomes": session["biomes"],
+      "items": session["items"],
+      "visits": session["visits"],
+      "kills": kills
+    }
+    self._conn.execute(
+        "INSERT OR REPLACE INTO sessions VALUES "
+        "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+          stats_file, save_dir, os.path.basename(stats_file), *signature,
+          session["timestamp"], session["seed"], session["build"],
+          kills.get("kill_count"), kills.get("death_count"),
+          json.dumps(data)))
+
+  def _query(self, where, params, order="ASC", limit=None):
+    "Yield the sessions matching the given WHERE clause, ordered by date"
+    query = "SELECT stats_file, build, seed, timestamp, data FROM sessions " \
+        f"WHERE {where} ORDER BY name {order}"
+    if limit is not None:
+      query += f" LIMIT {int(limit)}"
+    for stats_file, build, seed, timestamp, data in \
+        self._conn.execute(query, params):
+      session = {
+        "build": build,
+        "date": sessions.session_get_time(stats_file),
+        "seed": seed,
+        "timestamp": timestamp,
+        "_nodes": None,
+        "_files": {
+          "stats_file": stats_file,
+          "kills_file": sessions.get_kills_file(stats_file)
+        }
+      }
+      session.update(json.loads(data))
+      yield session
+
+  def table(self, save_dir):
+    "Get an aggregate.SessionTable of every session in the given save"
+    row = self._conn.execute("SELECT data FROM tables WHERE save_dir = ?",
+        (save_dir,)).fetchone()
+    if row is not None:
+      return aggregate.SessionTable.from_bytes(row[0])
+    table = aggregate.SessionTable.from_sessions(self.sessions(save_dir))
+    with self._conn:
+      self._conn.execute("INSERT OR REPLACE INTO tables VALUES (?, ?)",
+          (save_dir, table.to_bytes()))
+    return table
+
+  def sessions(self, save_dir, filter_term=None):
+    """
+    Yield the sessions in the given save matching the filter term, sorted
+    by date. The filter term is interpreted the same way as noita.py's
+    -s,--session argument; see sessions.is_date_term().
+    """
+    if not filter_term:
+      yield from self._query("save_dir = ?", (save_dir,))
+    elif filter_term == "last":
+      yield from self._query("save_dir = ?", (save_dir,), "DESC", 1)
+    else:
+      if filter_term == "today":
+        filter_term = datetime.date.today().strftime(constants.SESS_DATE_FORMAT)
+      name_glob = _glob_escape(filter_term) + "*"
+      if sessions.is_date_term(filter_term):
+        by_date = list(self._query("save_dir = ? AND name GLOB ?",
+          (save_dir, name_glob)))
+        if by_date:
+          yield from by_date
+          return
+      yield from self._query(
+          "save_dir = ? AND (name GLOB ? OR seed = ?)",
+          (save_dir, name_glob, filter_term))
+
+# vim: set ts=2 sts=2 sw=2:
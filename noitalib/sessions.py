@@ -9,16 +9,42 @@ A "session" is a stats.xml file with, optionally, a kills.xml file.
 """
 
 import datetime
+import glob
+import math
+import multiprocessing
 import os
+import sys
 
 import utility.loghelper
+from . import constants
 from . import xmltools
 logger = utility.loghelper.DelayLogger(__name__)
 
+def get_sessions_path(save_path):
+  "Get the directory holding the session files for the given save"
+  return os.path.join(save_path, "stats", "sessions")
+
+def get_stats_files(save_path):
+  "Get the paths to all of the stats.xml files in the given save"
+  return glob.glob(os.path.join(get_sessions_path(save_path), "*_stats.xml"))
+
 def get_kills_file(stats_file):
   "Get a kills.xml file from a given stats.xml file"
   return stats_file.replace("stats.xml", "kills.xml")
 
+def is_date_term(filter_term):
+  """
+  True if a session filter term is a valid YYYYMMDD date. Such a term is
+  taken to be a date, rather than a seed, if any session matches it.
+  """
+  if len(filter_term) != 8 or not filter_term.isdigit():
+    return False
+  try:
+    datetime.datetime.strptime(filter_term + "-", constants.SESS_DATE_FORMAT)
+  except ValueError:
+    return False
+  return True
+
 def session_get_time(stats_file):
   "Get the date and time the given session was played"
   # 20221013-203926_stats.xml
@@ -58,33 +84,116 @@ def parse_kills(kills_root):
     "deaths": xmltools.parse_entries_node(deaths_node, as_int=True)
   }
 
-def parse_session(stats_file, kills_file=None):
-  "Extract information from a given play session"
+def _stream_nodes(file_path, handlers):
+  """
+  Incrementally parse an XML file, calling handlers[tag](node) for each
+  child of the root element with a handler. Returns a copy of the root
+  element's attributes and raises ValueError if any handled child is
+  missing.
+  """
+  root_attrib = None
+  remaining = set(handlers)
+  for node in xmltools.iter_children(file_path):
+    if root_attrib is None:
+      root_attrib = dict(node.getparent().attrib)
+    if node.tag in handlers:
+      handlers[node.tag](node)
+      remaining.discard(node.tag)
+  if remaining:
+    raise ValueError(f"Failed to find {sorted(remaining)!r} in {file_path!r}")
+  return root_attrib
+
+def stream_stats(stats_file):
+  """
+  Extract the build, stats, biomes, and visits from a stats.xml file
+  without building its tree
+  """
+  result = {}
+  def store_attrib(key):
+    "Create a handler storing a copy of the node's attributes"
+    def handler(node):
+      result[key] = dict(node.attrib)
+    return handler
+  def store_visits(node):
+    "Store the biomes visited"
+    result["visits"] = xmltools.parse_entries_node(node)
+  root_attrib = _stream_nodes(stats_file, {
+    "stats": store_attrib("stats"),
+    "biome_baseline": store_attrib("biomes"),
+    "biomes_visited": store_visits
+  })
+  result["build"] = root_attrib["BUILD_NAME"]
+  return result
+
+def stream_kills(kills_file):
+  "Parse a kills.xml file without building its tree; see parse_kills()"
+  result = {}
+  def store_entries(key):
+    "Create a handler storing the node's entries"
+    def handler(node):
+      result[key] = xmltools.parse_entries_node(node, as_int=True)
+    return handler
+  root_attrib = _stream_nodes(kills_file, {
+    "kill_map": store_entries("kills"),
+    "death_map": store_entries("deaths")
+  })
+  return {
+    "kill_count": int(root_attrib["kills"]),
+    "death_count": int(root_attrib["deaths"]),
+    "kills": result["kills"],
+    "deaths": result["deaths"]
+  }
+
+def parse_session(stats_file, kills_file=None, keep_nodes=False):
+  """
+  Extract information from a given play session
+
+  By default, the files are parsed incrementally and "_nodes" is None. If
+  keep_nodes is True, the full XML trees are built and kept in "_nodes",
+  and "stats" and "biomes" are the attribute maps of their nodes.
+  """
   if kills_file is None:
     kills_file = get_kills_file(stats_file)
   date_played = session_get_time(stats_file)
-  stats_root = xmltools.parse_xml(stats_file, get_root=True)
+  if keep_nodes:
+    stats_root = xmltools.parse_xml(stats_file)
 
-  stats_node = xmltools.xml_get_child(stats_root, "stats")
-  biomes_node = xmltools.xml_get_child(stats_root, "biome_baseline")
-  visits_node = xmltools.xml_get_child(stats_root, "biomes_visited")
-  items_node = xmltools.xml_get_child(stats_root, "item_map")
+    stats_node = xmltools.xml_get_child(stats_root, "stats")
+    biomes_node = xmltools.xml_get_child(stats_root, "biome_baseline")
+    visits_node = xmltools.xml_get_child(stats_root, "biomes_visited")
 
-  build = stats_root.attrib["BUILD_NAME"]
-  stats = stats_node.attrib
+    build = stats_root.attrib["BUILD_NAME"]
+    stats = stats_node.attrib
+    biomes = biomes_node.attrib
+    visits = xmltools.parse_entries_node(visits_node)
+  else:
+    stats_root = None
+    stats_data = stream_stats(stats_file)
+    build = stats_data["build"]
+    stats = stats_data["stats"]
+    biomes = stats_data["biomes"]
+    visits = stats_data["visits"]
   seed = stats["world_seed"]
-  biomes = biomes_node.attrib
-  visits = xmltools.parse_entries_node(visits_node)
   items = {} # TODO
 
+  kills_root = None
   try:
-    kills_root = xmltools.parse_xml(kills_file, get_root=True)
-    kills = parse_kills(kills_root)
+    if keep_nodes:
+      kills_root = xmltools.parse_xml(kills_file)
+      kills = parse_kills(kills_root)
+    else:
+      kills = stream_kills(kills_file)
   except FileNotFoundError:
     logger.debug("No kills for session %r", os.path.basename(stats_file))
-    kills_root = None
     kills = {}
 
+  nodes = None
+  if keep_nodes:
+    nodes = {
+      "stats_file": stats_root,
+      "kills_file": kills_root
+    }
+
   return {
     "build": build,
     "date": date_played,
@@ -95,14 +204,239 @@ def parse_session(stats_file, kills_file=None):
     "items": items,
     "visits": visits,
     "kills": kills,
-    "_nodes": {
-      "stats_file": stats_root,
-      "kills_file": kills_root
-    },
+    "_nodes": nodes,
     "_files": {
       "stats_file": stats_file,
       "kills_file": kills_file
     }
   }
 
+def parse_value(value):
+  "Convert an attribute value to an int or float if it is a finite number"
+  try:
+    return int(value)
+  except ValueError:
+    pass
+  try:
+    number = float(value)
+  except ValueError:
+    return value
+  return number if math.isfinite(number) else value
+
+def _parse_attrib(attrib):
+  "Copy an attribute map to a dict, converting numeric values"
+  return {sys.intern(key): parse_value(value) for key, value in attrib.items()}
+
+def _changed_text(attrib, parsed):
+  "Get the attribute values that str() of the parsed value doesn't give"
+  return {key: value for key, value in attrib.items()
+      if str(parsed[key]) != value} or None
+
+class Session:
+  """
+  A parsed play session
+
+  Attribute values are copied out of the XML and numeric values are
+  converted to int or float once, so a Session never keeps an XML tree
+  alive. Indexing a Session works the same way as indexing the dict
+  returned by parse_session(), and to_dict() creates such a dict.
+
+  stats_text() gives the original text of each stat for display. Only the
+  text that str() of a parsed value doesn't reproduce, such as "1.50", is
+  kept, in stat_texts.
+  """
+  __slots__ = ("stats_file", "kills_file", "build", "date", "seed", "stats",
+      "biomes", "items", "visits", "kill_count", "death_count", "kills",
+      "deaths", "stat_texts")
+
+  def __init__(self, stats_file, kills_file, build, date, seed, stats,
+      biomes, items, visits, kill_count=None, death_count=None, kills=None,
+      deaths=None, stat_texts=None):
+    "See help(type(self))"
+    self.stats_file = stats_file
+    self.kills_file = kills_file
+    self.build = build
+    self.date = date
+    self.seed = seed
+    self.stats = stats
+    self.biomes = biomes
+    self.items = items
+    self.visits = visits
+    self.kill_count = kill_count
+    self.death_count = death_count
+    self.kills = kills
+    self.deaths = deaths
+    self.stat_texts = stat_texts
+
+  @classmethod
+  def from_dict(cls, session):
+    "Create a Session from a dict returned by parse_session()"
+    kills = session["kills"]
+    stats = _parse_attrib(session["stats"])
+    return cls(
+        session["_files"]["stats_file"],
+        session["_files"]["kills_file"],
+        session["build"],
+        session["date"],
+        int(session["seed"]),
+        stats,
+        _parse_attrib(session["biomes"]),
+        session["items"],
+        _parse_attrib(session["visits"]),
+        kills.get("kill_count"),
+        kills.get("death_count"),
+        kills.get("kills"),
+        kills.get("deaths"),
+        _changed_text(session["stats"], stats))
+
+  @classmethod
+  def parse(cls, stats_file, kills_file=None):
+    "Parse a session; see parse_session()"
+    return cls.from_dict(parse_session(stats_file, kills_file))
+
+  @property
+  def timestamp(self):
+    "The time the session was played, in seconds since the epoch"
+    return self.date.timestamp()
+
+  def stats_text(self):
+    "Get the stats with their original attribute text as values"
+    texts = self.stat_texts or {}
+    return {key: texts.get(key, str(value)) for key, value in self.stats.items()}
+
+  def _kills_dict(self):
+    "Get the kills in the format used by parse_kills()"
+    if self.kill_count is None:
+      return {}
+    return {
+      "kill_count": self.kill_count,
+      "death_count": self.death_count,
+      "kills": self.kills,
+      "deaths": self.deaths
+    }
+
+  def __getitem__(self, key):
+    "Get a field by its key in the dict returned by parse_session()"
+    if key == "seed":
+      return str(self.seed)
+    if key == "timestamp":
+      return self.timestamp
+    if key == "kills":
+      return self._kills_dict()
+    if key == "stats_text":
+      return self.stats_text()
+    if key == "_nodes":
+      return None
+    if key == "_files":
+      return {"stats_file": self.stats_file, "kills_file": self.kills_file}
+    if key in ("build", "date", "stats", "biomes", "items", "visits"):
+      return getattr(self, key)
+    raise KeyError(key)
+
+  def get(self, key, default=None):
+    "Get the given session field, or default if it does not exist"
+    try:
+      return self[key]
+    except KeyError:
+      return default
+
+  def to_dict(self):
+    "Convert to a dict with the same keys as parse_session() returns"
+    return {key: self[key] for key in SESSION_KEYS}
+
+  def __repr__(self):
+    "repr(self)"
+    return f"{type(self).__name__}({self.stats_file!r})"
+
+# Keys of the dict returned by parse_session() and Session.to_dict()
+SESSION_KEYS = ("build", "date", "seed", "timestamp", "stats", "biomes",
+    "items", "visits", "kills", "_nodes", "_files")
+
+def parse_sessions(stats_files, workers=None):
+  """
+  Parse the given sessions using up to workers processes (default: all
+  cores), yielding a Session for each in the same order as stats_files
+  """
+  stats_files = list(stats_files)
+  if workers == 1 or len(stats_files) <= 1:
+    yield from map(Session.parse, stats_files)
+    return
+  if workers is None:
+    workers = os.cpu_count() or 1
+  chunk_size = max(1, len(stats_files) // (workers * 4))
+  with multiprocessing.Pool(workers) as pool:
+    yield from pool.imap(Session.parse, stats_files, chunk_size)
+
+class SessionRef:
+  """
+  Lazily-parsed reference to a play session
+
+  The session's files and the date it was played are known from the
+  filename alone. The XML files are parsed into a Session the first time
+  any other information is requested. Indexing a SessionRef works the
+  same way as indexing the dict returned by parse_session().
+  """
+  __slots__ = ("stats_file", "kills_file", "date", "_session")
+
+  def __init__(self, stats_file, kills_file=None):
+    "See help(type(self))"
+    if kills_file is None:
+      kills_file = get_kills_file(stats_file)
+    self.stats_file = stats_file
+    self.kills_file = kills_file
+    self.date = session_get_time(stats_file)
+    self._session = None
+
+  @property
+  def name(self):
+    "The stats filename, which starts with the date and time played"
+    return os.path.basename(self.stats_file)
+
+  @property
+  def parsed(self):
+    "True if the session files have been parsed"
+    return self._session is not None
+
+  def load(self):
+    "Parse the session files (if needed) and return the Session"
+    if self._session is None:
+      logger.trace("Parsing session %r", self.stats_file)
+      self._session = Session.parse(self.stats_file, self.kills_file)
+    return self._session
+
+  def _set_session(self, session):
+    "Store a session parsed elsewhere, such as by parse_sessions()"
+    self._session = session
+
+  def __getitem__(self, key):
+    "Get the given session field, parsing the session only if needed"
+    if key == "date":
+      return self.date
+    if key == "timestamp":
+      return self.date.timestamp()
+    if key == "_files":
+      return {"stats_file": self.stats_file, "kills_file": self.kills_file}
+    return self.load()[key]
+
+  def get(self, key, default=None):
+    "Get the given session field, or default if it does not exist"
+    try:
+      return self[key]
+    except KeyError:
+      return default
+
+  def __repr__(self):
+    "repr(self)"
+    return f"{type(self).__name__}({self.stats_file!r})"
+
+def load_sessions(refs, workers=None):
+  """
+  Parse all of the given SessionRefs that are not yet parsed using up to
+  workers processes; see parse_sessions()
+  """
+  pending = [ref for ref in refs if not ref.parsed]
+  stats_files = [ref.stats_file for ref in pending]
+  for ref, session in zip(pending, parse_sessions(stats_files, workers)):
+    ref._set_session(session)
+
 # vim: set ts=2 sts=2 sw=2:
@@ -20,43 +20,25 @@ class WorldState:
   def __init__(self, file_path):
     "See help(type(self))"
     self._path = file_path
-    self._root = parse_world(file_path)
     self._globals = {}
     self._orbs = ()
     self._flags = ()
     self._shifts = ()
-    self._state = xmltools.xml_get_child(self._root, "WorldStateComponent")
-    self._interpret()
+    self._stat_file = None
+    self._interpret(xmltools.extract_xml(file_path, extract_world))
 
   @property
   def path(self):
     "Path to world file"
     return self._path
 
-  def _state_node(self, child=None):
-    "Get the WorldStateComponent node, or one of its children"
-    if child is not None:
-      return xmltools.xml_get_child(self._state, child)
-    return self._state
-
-  def _state_attrib(self, attrib, default=None):
-    "Get an attribute of the WorldStateComponent node"
-    return self._state.attrib.get(attrib, default)
-
-  def _interpret(self):
-    "Interpret self._root and (re)set self attributes"
-    lua_node = self._state_node("lua_globals")
-    self._globals = parse_entries_node(lua_node, as_int=True)
-    # TODO: pending_portals
-    # TODO: apparitions_per_level
-    # TODO: npc_parties
-    self._orbs = tuple(int(celem) for celem in \
-        parse_strings_node(self._state_node("orbs_found_thisrun")))
-    self._flags = parse_strings_node(self._state_node("flags"))
-    self._shifts = parse_strings_node(self._state_node("changed_materials"))
-    # TODO: cuts_through_world
-
-    self._stat_file = self._state_attrib("session_stat_file")
+  def _interpret(self, data):
+    "Interpret the result of extract_world() and (re)set self attributes"
+    self._globals = data["lua_globals"]
+    self._orbs = tuple(data["orbs"])
+    self._flags = data["flags"]
+    self._shifts = data["shifts"]
+    self._stat_file = data["session_stat_file"]
 
   def orbs(self):
     "Get the orbs that have been attained this run"
@@ -153,6 +135,25 @@ def get_world_file(save_path):
   "Return the path to the world file"
   return os.path.join(save_path, "world_state.xml")
 
+def extract_world(root):
+  "Extract the WorldStateComponent data from a parsed world file"
+  state = xmltools.xml_get_child(root, "WorldStateComponent")
+  def state_node(child):
+    "Get a child of the WorldStateComponent node"
+    return xmltools.xml_get_child(state, child)
+  # TODO: pending_portals
+  # TODO: apparitions_per_level
+  # TODO: npc_parties
+  # TODO: cuts_through_world
+  return {
+    "lua_globals": parse_entries_node(state_node("lua_globals"), as_int=True),
+    "orbs": [int(celem) for celem in
+      parse_strings_node(state_node("orbs_found_thisrun"))],
+    "flags": parse_strings_node(state_node("flags")),
+    "shifts": parse_strings_node(state_node("changed_materials")),
+    "session_stat_file": state.attrib.get("session_stat_file")
+  }
+
 def parse_world(world_path):
   "Parse the world.xml file"
   logger.trace("Parsing world file %r", world_path)
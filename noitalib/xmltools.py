@@ -2,21 +2,323 @@
 
 """
 Common XML-related functions to support Noita
+
+extract_xml() is backed by an XMLCache keyed by each file's path,
+modification time and size, so unchanged files are parsed at most once.
+parse_xml() uses the cache only when asked to, as the tree it returns is
+then shared:
+
+  data = extract_xml(path, extract_func)  # cached extract_func(root)
+  root = parse_xml(path, cache=True)      # cached tree; do not modify it
+
+The in-process layer is an LRU bounded by the total size of the cached
+files. configure_cache() can also enable an on-disk layer that pickles
+the results of extract_xml() between runs. Parsed trees themselves
+cannot be pickled and are only cached in-process.
 """
 
+import collections
+import hashlib
+import os
+import pickle
+import tempfile
+
 import lxml.etree as et
 
 import utility.loghelper
 logger = utility.loghelper.DelayLogger(__name__)
 
-def parse_xml(file_path, get_root=True):
-  "Helper function to read an XML file"
+CACHE_MAX_BYTES = 64 * 1024 * 1024 # Total size of files cached in-process
+CACHE_VERSION = 1 # Bump when the on-disk format changes
+CACHE_EXT = ".pickle"
+PARSE_CHUNK_SIZE = 64 * 1024 # Bytes fed to incremental parsers at a time
+
+def _file_signature(file_path):
+  "Get the (mtime, size) of a file"
+  fstat = os.stat(file_path)
+  return fstat.st_mtime_ns, fstat.st_size
+
+def _hash_code(digest, code):
+  "Add a code object's bytecode and constants to a hash"
+  digest.update(code.co_code)
+  digest.update(repr(code.co_names).encode())
+  for const in code.co_consts:
+    if hasattr(const, "co_code"):
+      _hash_code(digest, const)
+    elif isinstance(const, frozenset):
+      # Set order depends on string hashing, which varies between runs
+      digest.update(repr(sorted(map(repr, const))).encode())
+    else:
+      digest.update(repr(const).encode())
+
+def _extract_name(extract):
+  """
+  Get a name identifying an extraction function across runs. The name
+  includes a hash of the function's code so that entries pickled by an
+  older version of the function are not used. Changes to the functions
+  it calls are not detected; bump CACHE_VERSION for those.
+  """
+  name = f"{extract.__module__}.{extract.__qualname__}"
+  code = getattr(extract, "__code__", None)
+  if code is None:
+    return name
+  digest = hashlib.sha1()
+  _hash_code(digest, code)
+  return f"{name}@{digest.hexdigest()[:16]}"
+
+def _parse_tree(file_path):
+  "Parse an XML file, returning the ElementTree"
   with open(file_path, "rt") as fobj:
-    root = et.parse(fobj)
+    return et.parse(fobj)
+
+class XMLCache:
+  """
+  Cache of parsed XML files and of data extracted from them
+
+  Entries are keyed by the file's real path and are discarded once the
+  file's modification time or size changes. The least recently used
+  entries are evicted once the cached files total more than max_bytes.
+  If cache_dir is given, extracted data is also pickled to that
+  directory.
+  """
+  def __init__(self, max_bytes=CACHE_MAX_BYTES, cache_dir=None):
+    "See help(type(self))"
+    self._max_bytes = max_bytes
+    self._cache_dir = cache_dir
+    self._entries = collections.OrderedDict()
+    self._size = 0
+    self.hits = 0
+    self.misses = 0
+    if cache_dir is not None:
+      os.makedirs(cache_dir, exist_ok=True)
+
+  def __len__(self):
+    "Number of entries cached in-process"
+    return len(self._entries)
+
+  @property
+  def cache_dir(self):
+    "Directory of the on-disk layer, or None"
+    return self._cache_dir
+
+  def clear(self):
+    "Discard the in-process entries; the on-disk layer is kept"
+    self._entries.clear()
+    self._size = 0
+
+  def _get(self, key, signature):
+    "Get an in-process entry if it is current; returns (found, value)"
+    entry = self._entries.get(key)
+    if entry is None:
+      return False, None
+    if entry[0] != signature:
+      self._remove(key)
+      return False, None
+    self._entries.move_to_end(key)
+    return True, entry[1]
+
+  def _put(self, key, signature, value):
+    "Add an in-process entry, evicting old entries as needed"
+    if key in self._entries:
+      self._remove(key)
+    cost = signature[1]
+    if cost > self._max_bytes:
+      return
+    self._entries[key] = (signature, value)
+    self._size += cost
+    while self._size > self._max_bytes:
+      self._remove(next(iter(self._entries)))
+
+  def _remove(self, key):
+    "Remove an in-process entry"
+    signature, _ = self._entries.pop(key)
+    self._size -= signature[1]
+
+  def _disk_path(self, key):
+    "Get the on-disk path for a key"
+    digest = hashlib.sha1(repr(key).encode()).hexdigest()
+    return os.path.join(self._cache_dir, digest + CACHE_EXT)
+
+  def _disk_load(self, key, signature):
+    "Load pickled data for a key; returns (found, value)"
+    try:
+      with open(self._disk_path(key), "rb") as fobj:
+        version, disk_key, disk_signature, value = pickle.load(fobj)
+    except FileNotFoundError:
+      return False, None
+    except (OSError, EOFError, ValueError, TypeError,
+        pickle.UnpicklingError, AttributeError, ImportError) as err:
+      logger.debug("Ignoring unreadable cache entry for %s: %s", key[0], err)
+      return False, None
+    if (version, disk_key, disk_signature) != (CACHE_VERSION, key, signature):
+      return False, None
+    return True, value
+
+  def _disk_store(self, key, signature, value):
+    "Pickle data for a key, replacing any existing entry"
+    temp_path = None
+    try:
+      fdesc, temp_path = tempfile.mkstemp(dir=self._cache_dir, suffix=".tmp")
+      with os.fdopen(fdesc, "wb") as fobj:
+        pickle.dump((CACHE_VERSION, key, signature, value), fobj,
+            pickle.HIGHEST_PROTOCOL)
+      os.replace(temp_path, self._disk_path(key))
+    except (OSError, pickle.PicklingError, TypeError, AttributeError) as err:
+      logger.warning("Failed to cache data for %s: %s", key[0], err)
+      if temp_path is not None and os.path.exists(temp_path):
+        os.unlink(temp_path)
+
+  def parse(self, file_path):
+    "Get the parsed ElementTree of a file"
+    key = (os.path.realpath(file_path), None)
+    signature = _file_signature(file_path)
+    found, tree = self._get(key, signature)
+    if found:
+      self.hits += 1
+      return tree
+    self.misses += 1
+    tree = _parse_tree(file_path)
+    self._put(key, signature, tree)
+    return tree
+
+  def extract(self, file_path, extract):
+    """
+    Get extract(root) for the root element of a file. The result should
+    be picklable if the on-disk layer is enabled.
+    """
+    key = (os.path.realpath(file_path), _extract_name(extract))
+    signature = _file_signature(file_path)
+    found, value = self._get(key, signature)
+    if not found and self._cache_dir is not None:
+      found, value = self._disk_load(key, signature)
+      if found:
+        self._put(key, signature, value)
+    if found:
+      self.hits += 1
+      return value
+    self.misses += 1
+    value = extract(self.parse(file_path).getroot())
+    self._put(key, signature, value)
+    if self._cache_dir is not None:
+      self._disk_store(key, signature, value)
+    return value
+
+_cache = XMLCache()
+
+def get_cache():
+  "Get the XMLCache used by parse_xml() and extract_xml()"
+  return _cache
+
+def configure_cache(max_bytes=CACHE_MAX_BYTES, cache_dir=None):
+  "Replace the XMLCache used by parse_xml() and extract_xml()"
+  global _cache # pylint: disable=global-statement
+  _cache = XMLCache(max_bytes, cache_dir)
+  return _cache
+
+def parse_xml(file_path, get_root=True, cache=False):
+  """
+  Helper function to read an XML file
+
+  If cache is True, the result comes from the XMLCache and is shared with
+  other callers, so it must not be modified.
+  """
+  if cache:
+    root = _cache.parse(file_path)
+  else:
+    root = _parse_tree(file_path)
   if get_root:
     return root.getroot()
   return root
 
+def extract_xml(file_path, extract, cache=True):
+  """
+  Parse an XML file and return extract(root), caching the result; see
+  XMLCache.extract()
+  """
+  if cache:
+    return _cache.extract(file_path, extract)
+  return extract(_parse_tree(file_path).getroot())
+
+def iter_children(file_path, tags=None):
+  """
+  Incrementally parse an XML file, yielding each child of the root element
+  once it has been fully parsed. Children are cleared and discarded after
+  the caller resumes iteration, so the full tree is never built. The root
+  element is available via child.getparent(), but it is empty.
+
+  If tags is given, only children with one of those tags are yielded.
+  Other children are discarded without being seen by the caller.
+  """
+  if tags is not None:
+    yield from _iter_children_tagged(file_path, tags)
+    return
+  depth = 0
+  with open(file_path, "rb") as fobj:
+    for event, elem in et.iterparse(fobj, events=("start", "end")):
+      if event == "start":
+        depth += 1
+        continue
+      depth -= 1
+      if depth == 1:
+        yield elem
+        elem.clear()
+        while elem.getprevious() is not None:
+          del elem.getparent()[0]
+
+def _read_root_tag(fobj):
+  """
+  Read chunks of fobj until the root element's start tag has been parsed.
+  Returns (tag, chunks read); tag is None if there is no root element.
+  """
+  parser = et.XMLPullParser(events=("start",))
+  chunks = []
+  while True:
+    data = fobj.read(PARSE_CHUNK_SIZE)
+    if not data:
+      return None, chunks
+    chunks.append(data)
+    parser.feed(data)
+    for _, elem in parser.read_events():
+      return elem.tag, chunks
+
+def _iter_children_tagged(file_path, tags):
+  "Implement iter_children() for specific tags"
+  # Let lxml match the tags itself so that other elements never reach
+  # Python. The root's tag is matched too, so that the root is known from
+  # its start event and skipped children are always discarded after every
+  # chunk, even if no child matches.
+  tags = set(tags)
+  with open(file_path, "rb") as fobj:
+    root_tag, chunks = _read_root_tag(fobj)
+    match_tags = tags if root_tag is None else tags | {root_tag}
+    parser = et.XMLPullParser(events=("start", "end"), tag=list(match_tags))
+    chunks = iter(chunks)
+    root = None
+    while True:
+      data = next(chunks, None) or fobj.read(PARSE_CHUNK_SIZE)
+      if data:
+        parser.feed(data)
+      else:
+        parser.close()
+      for event, elem in parser.read_events():
+        if root is None:
+          root = elem
+          continue
+        if event == "start" or elem.getparent() is not root \
+            or elem.tag not in tags:
+          continue
+        yield elem
+        elem.clear()
+        while elem.getprevious() is not None:
+          del root[0]
+      if not data:
+        break
+      if root is not None and len(root):
+        # Keep the last child; it may not be complete yet
+        last = root[-1]
+        while root[0] is not last:
+          del root[0]
+
 def xml_get_child(node, cname):
   "Return the named child node. Raises an error if the child can't be found"
   cnode = node.find(cname)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+"""
+Verify the RNG and alchemy implementations against the golden corpus
+
+Run from the repository root:
+
+  python -m pytest tests
+  python -m unittest discover tests
+"""
+
+import logging
+import unittest
+
+from noitalib import alchemy
+from noitalib import golden
+
+# A sample of about five seconds; for a larger one, run
+#   python -m noitalib.alchemy --cross-check NUM
+CROSS_CHECK_SEEDS = 50000
+CROSS_CHECK_STATE = 20221013
+
+class GoldenCorpusTest(unittest.TestCase):
+  "Every backend must reproduce the corpus exactly"
+  @classmethod
+  def setUpClass(cls):
+    "Load the corpus once"
+    cls.vectors = golden.load_corpus()
+
+  def test_corpus_size(self):
+    "The corpus covers every seed it claims to"
+    self.assertEqual([vector.seed for vector in self.vectors],
+        golden.corpus_seeds())
+
+  def test_backends(self):
+    "Each available backend matches the corpus"
+    for name in golden.available_backends():
+      with self.subTest(backend=name):
+        self.assertEqual(golden.BACKENDS[name](self.vectors), 0)
+
+  def test_detects_mismatch(self):
+    "A corrupted vector is reported"
+    vector = self.vectors[0]
+    bad = vector._replace(int_stream=[value + 1
+      for value in vector.int_stream])
+    logging.disable(logging.ERROR)
+    try:
+      self.assertGreater(golden.verify_rng_definition([bad]), 0)
+      self.assertGreater(golden.verify_rng_scalar([bad]), 0)
+    finally:
+      logging.disable(logging.NOTSET)
+
+class CrossCheckTest(unittest.TestCase):
+  "The fixed-point and Decimal seed scaling must agree"
+  def test_cross_check(self):
+    "No random seed differs between the two calculations"
+    self.assertEqual(
+        alchemy.cross_check(CROSS_CHECK_SEEDS, CROSS_CHECK_STATE), [])
+
+  def test_edge_seeds(self):
+    "The corpus edge seeds agree too"
+    for seed in golden.EDGE_SEEDS:
+      with self.subTest(seed=seed):
+        self.assertEqual(alchemy._calculate(seed),
+            alchemy._calculate_decimal(seed))
+
+if __name__ == "__main__":
+  unittest.main()
+
+# vim: set ts=2 sts=2 sw=2:
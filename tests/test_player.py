@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+"""
+Check that streaming a player.xml file agrees with parsing it
+
+Run from the repository root:
+
+  python -m pytest tests
+  python -m unittest discover tests
+"""
+
+import os
+import tempfile
+import unittest
+
+from noitalib import player
+from noitalib import xmltools
+
+# Children skipped by every section, to separate the interesting ones
+PADDING = "".join(
+    f'<SpriteComponent image_file="data/x{idx}.xml" offset_x="{idx}">'
+    '<transform_offset x="0" y="0"></transform_offset></SpriteComponent>'
+    for idx in range(50))
+
+def _strings(tag, values):
+  "Build a node of <string> children"
+  items = "".join(f"<string>{value}</string>" for value in values)
+  return f"<{tag}>{items}</{tag}>"
+
+PLAYER_XML = "".join((
+  '<Entity name="DEBUG_NAME:player" tags="player_unit,teleportable">',
+  '<_Transform position.x="227.5" position.y="-85.25" rotation="0" '
+  'scale.x="1" scale.y="1"></_Transform>',
+  PADDING,
+  '<CharacterDataComponent _enabled="1" mass="0.9"></CharacterDataComponent>',
+  '<DamageModelComponent hp="4" max_hp="4.4" blood_material="blood_fading" '
+  'blood_spray_material="blood" blood_multiplier="1" air_in_lungs="7" '
+  'air_in_lungs_max="7" air_lack_of_damage="0.6" '
+  'materials_how_much_damage="0.1,0.0005" materials_that_damage="acid,lava">'
+  '<damage_multipliers fire="1" ice="1.5"></damage_multipliers>'
+  '</DamageModelComponent>',
+  # Only the first component of most sections is interpreted
+  '<DamageModelComponent hp="1" max_hp="1"></DamageModelComponent>',
+  '<DrugEffectComponent _enabled="1" fungal="0" stoned="1.5">'
+  '</DrugEffectComponent>',
+  '<MaterialInventoryComponent _tags="ingestion"><count_per_material_type>'
+  '<Material material="water" count="12"></Material>'
+  '<Material material="blood" count="4"></Material>'
+  '</count_per_material_type></MaterialInventoryComponent>',
+  '<StatusEffectDataComponent '
+  'ingestion_effect_causes="air,BERSERK,blood,slime">',
+  _strings("stain_effects", ["0", "1", "0", "2"]),
+  _strings("effects_previous", ["0"] * 4),
+  _strings("ingestion_effects", ["0", "3", "1", "0"]),
+  _strings("ingestion_effect_causes_many", ["0"] * 4),
+  '</StatusEffectDataComponent>',
+  PADDING,
+  '<WalletComponent money="512" money_spent="100" mHasReachedInf="0">'
+  '</WalletComponent>',
+  '<WalletComponent money="1" money_spent="1" mHasReachedInf="1">'
+  '</WalletComponent>',
+  '<Entity name="arm_r" tags="player_arm_r"></Entity>',
+  '<Entity name="inventory_quick" tags="">',
+  '<Entity tags="wand,teleportable">'
+  '<ItemComponent item_name="" ui_description=""></ItemComponent></Entity>',
+  '<Entity tags="item_pickup,potion,teleportable">'
+  '<ItemComponent item_name="$item_potion" '
+  'ui_description="$item_description_potion"></ItemComponent>'
+  '<MaterialInventoryComponent><count_per_material_type>'
+  '<Material material="water" count="500"></Material>'
+  '</count_per_material_type></MaterialInventoryComponent></Entity>',
+  '<Entity tags="item_pickup,egg_item">'
+  '<ItemComponent item_name="$item_egg" '
+  'ui_description="$item_description_egg"></ItemComponent></Entity>',
+  '</Entity>',
+  '<Entity name="inventory_full" tags="">'
+  '<Entity tags="card_action"><ItemComponent item_name="$action_bomb" '
+  'ui_description="$actiondesc_bomb"></ItemComponent></Entity></Entity>',
+  PADDING,
+  '</Entity>'))
+
+# Accessors covering each of player.STREAM_SECTIONS
+STREAM_ACCESSORS = {
+  "transform": ("pos",),
+  "damages": ("health", "max_health", "blood_material",
+    "blood_spray_material", "blood_multiplier", "air", "air_max",
+    "drowning_damage", "material_damages", "damage_multipliers"),
+  "status_effects": ("status_effects",),
+  "wallet": ("money", "money_spent", "money_inf"),
+  "entities": ("wands", "items", "spells")
+}
+
+def _get(plr, accessor):
+  "Get a Player property or call a Player method"
+  value = getattr(plr, accessor)
+  return value() if callable(value) else value
+
+class PlayerStreamTest(unittest.TestCase):
+  "Player.from_stream() must agree with Player()"
+  def setUp(self):
+    "Write the player file"
+    self.tempdir = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.tempdir.name, "player.xml")
+    with open(self.path, "wt") as fobj:
+      fobj.write(PLAYER_XML)
+
+  def tearDown(self):
+    "Remove the player file"
+    self.tempdir.cleanup()
+
+  def test_accessors_cover_stream_sections(self):
+    "Every default stream section is compared below"
+    self.assertEqual(sorted(STREAM_ACCESSORS), sorted(player.STREAM_SECTIONS))
+
+  def test_default_sections(self):
+    "The default sections match a full parse"
+    parsed = player.Player(self.path)
+    parsed._interpret() # pylint: disable=protected-access
+    streamed = player.Player.from_stream(self.path)
+    for section, accessors in STREAM_ACCESSORS.items():
+      for accessor in accessors:
+        with self.subTest(section=section, accessor=accessor):
+          self.assertEqual(_get(streamed, accessor), _get(parsed, accessor))
+
+  def test_lazy_sections(self):
+    "Sections interpreted on demand match a full parse"
+    parsed = player.Player(self.path)
+    parsed._interpret() # pylint: disable=protected-access
+    lazy = player.Player(self.path)
+    for section, accessors in STREAM_ACCESSORS.items():
+      for accessor in accessors:
+        with self.subTest(section=section, accessor=accessor):
+          self.assertEqual(_get(lazy, accessor), _get(parsed, accessor))
+
+  def test_selected_sections(self):
+    "Sections that weren't streamed keep their defaults"
+    streamed = player.Player.from_stream(self.path, ("wallet",))
+    default = player.Player(self.path, parse=False)
+    self.assertEqual(streamed.money, 512)
+    self.assertEqual(streamed.health, _get(default, "health"))
+    self.assertEqual(streamed.items, [])
+
+class IterChildrenTest(unittest.TestCase):
+  "xmltools.iter_children() must yield the same children with any filter"
+  def setUp(self):
+    "Write the player file"
+    self.tempdir = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.tempdir.name, "player.xml")
+    with open(self.path, "wt") as fobj:
+      fobj.write(PLAYER_XML)
+
+  def tearDown(self):
+    "Remove the player file"
+    self.tempdir.cleanup()
+
+  def _children(self, tags=None):
+    "Get (tag, attributes) of each child yielded"
+    return [(elem.tag, dict(elem.attrib))
+        for elem in xmltools.iter_children(self.path, tags)]
+
+  def test_tags(self):
+    "Filtering by tag matches filtering the unfiltered children"
+    children = self._children()
+    for tags in ({"WalletComponent"}, {"Entity"},
+        {"_Transform", "DamageModelComponent"}):
+      with self.subTest(tags=tags):
+        self.assertEqual(self._children(tags),
+            [child for child in children if child[0] in tags])
+
+  def test_no_match(self):
+    "Nothing is yielded if no child matches"
+    self.assertEqual(self._children({"NoSuchComponent"}), [])
+
+if __name__ == "__main__":
+  unittest.main()
+
+# vim: set ts=2 sts=2 sw=2:
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+"""
+Check RNG tracing
+
+Run from the repository root:
+
+  python -m pytest tests
+  python -m unittest discover tests
+"""
+
+import os
+import tempfile
+import unittest
+
+from noitalib import alchemy
+from utility import prng
+
+class TraceTest(unittest.TestCase):
+  "Tracing must not change results and must survive dump() and load()"
+  def _trace_recipes(self, seed):
+    "Calculate the recipes for a seed while tracing"
+    trace = prng.enable_trace()
+    try:
+      recipes = alchemy.calculate_ap_lc_recipe(seed)
+    finally:
+      prng.disable_trace()
+    return recipes, trace
+
+  def test_recipes(self):
+    "Tracing the recipe calculation gives the untraced recipes"
+    recipes, trace = self._trace_recipes(5)
+    self.assertEqual(recipes, alchemy.calculate_ap_lc_recipe(5))
+    self.assertGreater(len(trace), 0)
+
+  def test_mixed_denominators(self):
+    "Fixed-point and integer draws are recorded with their denominators"
+    _, trace = self._trace_recipes(5)
+    denoms = {record[4] for record in trace.records()}
+    self.assertEqual(denoms, {1, prng.SEED_DENOM})
+    for seed, _, value, _, denom in trace.records():
+      if denom == prng.SEED_DENOM:
+        self.assertEqual(seed, prng.scale_seed(5))
+        self.assertLess(value, prng.RAND_MAX * denom)
+
+  def test_round_trip(self):
+    "A dumped trace loads with the same records"
+    _, trace = self._trace_recipes(5)
+    with tempfile.TemporaryDirectory() as tempdir:
+      path = os.path.join(tempdir, "trace.bin")
+      trace.dump(path)
+      loaded = prng.RNGTrace.load(path)
+    self.assertEqual(list(loaded.records()), list(trace.records()))
+
+if __name__ == "__main__":
+  unittest.main()
+
+# vim: set ts=2 sts=2 sw=2:
@@ -18,15 +18,44 @@ Thus the next value is calculated via
   if v < 0: v += m
   return v
 
+This is the multiplicative LCG v' = a * v mod m, so advancing k steps
+at once is v * (a^k mod m) mod m. See NoitaRNG.skip().
+
 https://craftofcoding.wordpress.com/2021/07/05/demystifying-random-numbers-schrages-method/
+
+Noita scales the world seed by a non-integral factor before seeding the
+RNG, and the fractional part carries through every iteration. Rather than
+using decimal.Decimal, values can be kept as exact fixed-point numerators
+over a denominator (SEED_DENOM for scaled seeds); q, r and m are then
+scaled by the denominator. See scale_seed().
+
+NoitaRNG performs no logging per draw. To inspect individual draws, call
+enable_trace() to rebind NoitaRNG to a tracing implementation that
+records the seed, step index, value, consumer and denominator of every
+draw into an RNGTrace, which can be dumped to and loaded from a binary
+file.
+disable_trace() restores the untraced implementation.
+
+NoitaRNGArray advances many independent seeds in lockstep and requires
+numpy. Every intermediate value above fits within a signed 64-bit integer,
+even with a SEED_DENOM denominator.
 """
 
 import argparse
+import array
 import decimal
 import logging
 import os
+import struct
 import sys
 
+try:
+  import numpy
+  HAVE_NUMPY = True
+except ImportError:
+  numpy = None
+  HAVE_NUMPY = False
+
 logging.basicConfig(format="%(module)s:%(lineno)s: %(levelname)s: %(message)s",
                     level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -42,40 +71,237 @@ RAND_MOD = RAND_MAX % RAND_COEFF    # r = 2836
 SEED_SCALE  = decimal.Decimal("0.17127000")
 SEED_OFFSET = decimal.Decimal("1323.59030000")
 
+# The above as exact fixed-point numerators over SEED_DENOM
+SEED_DIGITS = 8
+SEED_DENOM = 10**SEED_DIGITS
+SEED_SCALE_FIXED = int(SEED_SCALE.scaleb(SEED_DIGITS))
+SEED_OFFSET_FIXED = int(SEED_OFFSET.scaleb(SEED_DIGITS))
+
+def scale_seed(world_seed):
+  """
+  Rescale a world seed the way Noita does it
+
+  Returns the exact scaled seed as a numerator over SEED_DENOM; use
+  NoitaRNG(scale_seed(world_seed), SEED_DENOM). This equals
+  world_seed * SEED_SCALE + SEED_OFFSET without decimal arithmetic.
+  """
+  return world_seed * SEED_SCALE_FIXED + SEED_OFFSET_FIXED
+
+class RNGTrace:
+  """
+  Record of individual RNG draws
+
+  Each record is (seed, step, value, consumer, denom): the generator's
+  initial seed, the number of draws the generator has made while tracing
+  was enabled, the new value, the name of the function that requested
+  the draw, and the generator's fixed-point denominator. Seeds and values
+  are stored as 64-bit integer numerators over denom, so one trace can
+  hold draws from generators with different denominators. Decimal values
+  are truncated.
+
+  The binary file format is a header followed by the consumer names, the
+  denominators, and then each field as a little-endian column. Consumers
+  and denominators are stored as indexes into those tables.
+  """
+  MAGIC = b"NRNGTRCE"
+  VERSION = 3
+  # magic, version, number of consumers, number of records
+  HEADER = struct.Struct("<8sIIQ")
+  # Version 2 traces hold a single denominator; version 1 traces use 1
+  DENOM = struct.Struct("<Q")
+  NUM_DENOMS = struct.Struct("<I")
+  NAME_SIZE = struct.Struct("<H")
+  COLUMNS = (("seeds", "q"), ("steps", "Q"), ("values", "q"),
+      ("consumers", "H"), ("denoms", "H"))
+
+  def __init__(self):
+    "See help(type(self))"
+    self._names = []
+    self._name_codes = {}
+    self._denoms = []
+    self._denom_codes = {}
+    self.seeds = array.array("q")
+    self.steps = array.array("Q")
+    self.values = array.array("q")
+    self.consumers = array.array("H")
+    self.denoms = array.array("H")
+
+  def __len__(self):
+    "Number of records"
+    return len(self.seeds)
+
+  def record(self, seed, step, value, consumer, denom=1):
+    "Append a single record"
+    code = self._name_codes.get(consumer)
+    if code is None:
+      code = self._name_codes[consumer] = len(self._names)
+      self._names.append(consumer)
+    denom_code = self._denom_codes.get(denom)
+    if denom_code is None:
+      denom_code = self._denom_codes[denom] = len(self._denoms)
+      self._denoms.append(denom)
+    self.seeds.append(int(seed))
+    self.steps.append(step)
+    self.values.append(int(value))
+    self.consumers.append(code)
+    self.denoms.append(denom_code)
+
+  def records(self):
+    "Yield (seed, step, value, consumer, denom) tuples"
+    names = self._names
+    denoms = self._denoms
+    for seed, step, value, code, denom_code in zip(
+        self.seeds, self.steps, self.values, self.consumers, self.denoms):
+      yield seed, step, value, names[code], denoms[denom_code]
+
+  def dump(self, path):
+    "Write the trace to a binary file"
+    with open(path, "wb") as fobj:
+      fobj.write(self.HEADER.pack(self.MAGIC, self.VERSION,
+        len(self._names), len(self)))
+      for name in self._names:
+        name_bytes = name.encode()
+        fobj.write(self.NAME_SIZE.pack(len(name_bytes)))
+        fobj.write(name_bytes)
+      fobj.write(self.NUM_DENOMS.pack(len(self._denoms)))
+      for denom in self._denoms:
+        fobj.write(self.DENOM.pack(denom))
+      for attr, _ in self.COLUMNS:
+        column = getattr(self, attr)
+        if sys.byteorder != "little":
+          column = array.array(column.typecode, column)
+          column.byteswap()
+        column.tofile(fobj)
+
+  @classmethod
+  def load(cls, path):
+    "Read a trace written by dump()"
+    trace = cls()
+    with open(path, "rb") as fobj:
+      magic, version, num_names, num_records = cls.HEADER.unpack(
+          fobj.read(cls.HEADER.size))
+      if magic != cls.MAGIC or version not in (1, 2, cls.VERSION):
+        raise ValueError(f"{path!r} is not an RNG trace file")
+      columns = cls.COLUMNS
+      if version == 2:
+        denom, = cls.DENOM.unpack(fobj.read(cls.DENOM.size))
+      for code in range(num_names):
+        size, = cls.NAME_SIZE.unpack(fobj.read(cls.NAME_SIZE.size))
+        name = fobj.read(size).decode()
+        trace._names.append(name)
+        trace._name_codes[name] = code
+      if version >= 3:
+        num_denoms, = cls.NUM_DENOMS.unpack(fobj.read(cls.NUM_DENOMS.size))
+        for code in range(num_denoms):
+          denom, = cls.DENOM.unpack(fobj.read(cls.DENOM.size))
+          trace._denoms.append(denom)
+          trace._denom_codes[denom] = code
+      else:
+        # Older traces hold a single denominator for every record
+        columns = columns[:-1]
+        if version == 1:
+          denom = 1
+        trace._denoms.append(denom)
+        trace._denom_codes[denom] = 0
+        trace.denoms = array.array("H", bytes(2 * num_records))
+      for attr, typecode in columns:
+        column = array.array(typecode)
+        column.fromfile(fobj, num_records)
+        if sys.byteorder != "little":
+          column.byteswap()
+        setattr(trace, attr, column)
+    return trace
+
+_TRACE = None
+
+def _trace_consumer():
+  "Get the name of the nearest calling function that isn't a NoitaRNG method"
+  frame = sys._getframe(2) # pylint: disable=protected-access
+  while frame is not None and frame.f_code in _RNG_CODES:
+    frame = frame.f_back
+  return frame.f_code.co_name if frame is not None else "<unknown>"
+
 class NoitaRNG:
-  "Implement Noita's RNG"
-  def __init__(self, seed):
+  """
+  Implement Noita's RNG
+
+  The seed and every value are numerators over denom (default 1). Pass
+  denom=SEED_DENOM for seeds created via scale_seed().
+  """
+  def __init__(self, seed, denom=1):
     self._seed = seed
     self._value = seed
+    self._denom = denom
+    self._div = RAND_DIV * denom
+    self._mod = RAND_MOD * denom
+    self._max = RAND_MAX * denom
+    self._scale = RAND_SCALE * denom
+    self._step = 0
 
   @property
   def seed(self):
-    "Obtain the initial seed"
+    "Obtain the initial seed (as a numerator over denom)"
     return self._seed
 
   @property
   def value(self):
-    "Obtain the current value"
+    "Obtain the current value (as a numerator over denom)"
     return self._value
 
+  @property
+  def denom(self):
+    "Obtain the fixed-point denominator"
+    return self._denom
+
   def next(self):
     "Advance the value by one iteration and return the new value"
-    x_div = self._value // RAND_DIV
-    x_mod = self._value % RAND_DIV
-    next_value = x_div * RAND_MOD + x_mod * RAND_COEFF
+    # Schrage's method for a * value mod m; see the module docstring. This
+    # must subtract r * (value div q): adding it, as older versions did,
+    # does not compute a * value mod m and can leave [1, m).
+    x_div = self._value // self._div
+    x_mod = self._value % self._div
+    next_value = x_mod * RAND_COEFF - x_div * self._mod
     if next_value <= 0:
-      next_value += RAND_MAX
-    logger.debug("Advance %d -> %d (%f)",
-        self._value, next_value, next_value / RAND_SCALE)
+      next_value += self._max
+    self._value = next_value
+    return self._value
+
+  def next_n(self, count):
+    "Advance the value count times and return an array of the new values"
+    values = array.array("q", [0]) * count
+    value = self._value
+    rand_div, rand_mod, rand_max = self._div, self._mod, self._max
+    for idx in range(count):
+      value = (value % rand_div) * RAND_COEFF - (value // rand_div) * rand_mod
+      if value <= 0:
+        value += rand_max
+      values[idx] = value
+    self._value = value
+    return values
+
+  def skip(self, count):
+    "Advance the value by count iterations in O(log count) time"
+    if count <= 0:
+      return self._value
+    if isinstance(self._value, decimal.Decimal):
+      # Scaled seeds carry a fractional part; reduce in fixed point
+      digits = max(0, -self._value.as_tuple().exponent)
+      modulus = RAND_MAX * 10**digits
+      numer = int(self._value.scaleb(digits))
+      numer = numer * pow(RAND_COEFF, count, modulus) % modulus
+      if numer <= 0:
+        numer += modulus
+      next_value = decimal.Decimal(numer).scaleb(-digits)
+    else:
+      next_value = self._value * pow(RAND_COEFF, count, self._max) % self._max
+      if next_value <= 0:
+        next_value += self._max
     self._value = next_value
     return self._value
 
   def select(self, num_items):
     "Choose a random number between 0 and num_items-1 inclusive"
-    value = self.next() / RAND_SCALE
-    index = int(num_items * value)
-    logger.debug("Chose index %d of %d", index, num_items)
-    return index
+    return int(num_items * self.next() // self._scale)
 
   def choose(self, chooser, unique=False, iter_limit=1000):
     "Choose a random entry from the chooser mapping"
@@ -89,13 +315,140 @@ class NoitaRNG:
         return choice
     return None
 
+  # Untraced implementations, restored by disable_trace()
+  _fast_next = next
+  _fast_next_n = next_n
+  _fast_skip = skip
+
+  def _traced_next(self):
+    "As next(), but record the draw to the active RNGTrace"
+    value = self._fast_next()
+    self._step += 1
+    _TRACE.record(self._seed, self._step, value, _trace_consumer(),
+        self._denom)
+    return value
+
+  def _traced_next_n(self, count):
+    "As next_n(), but record the draws to the active RNGTrace"
+    values = self._fast_next_n(count)
+    consumer = _trace_consumer()
+    for value in values:
+      self._step += 1
+      _TRACE.record(self._seed, self._step, value, consumer, self._denom)
+    return values
+
+  def _traced_skip(self, count):
+    "As skip(), but record the resulting value to the active RNGTrace"
+    value = self._fast_skip(count)
+    if count > 0:
+      self._step += count
+      _TRACE.record(self._seed, self._step, value, _trace_consumer(),
+          self._denom)
+    return value
+
+_TRACED_METHODS = ("next", "next_n", "skip")
+_RNG_CODES = frozenset(_func.__code__ for _func in vars(NoitaRNG).values()
+    if hasattr(_func, "__code__"))
+
+def enable_trace(trace=None):
+  "Begin recording every NoitaRNG draw to trace (or a new RNGTrace)"
+  global _TRACE # pylint: disable=global-statement
+  _TRACE = trace if trace is not None else RNGTrace()
+  for name in _TRACED_METHODS:
+    setattr(NoitaRNG, name, getattr(NoitaRNG, "_traced_" + name))
+  return _TRACE
+
+def disable_trace():
+  "Stop recording NoitaRNG draws; returns the RNGTrace, if any"
+  global _TRACE # pylint: disable=global-statement
+  for name in _TRACED_METHODS:
+    setattr(NoitaRNG, name, getattr(NoitaRNG, "_fast_" + name))
+  trace, _TRACE = _TRACE, None
+  return trace
+
+class NoitaRNGArray:
+  """
+  Implement Noita's RNG for many seeds at once using numpy
+
+  As with NoitaRNG, seeds and values are numerators over denom.
+  """
+  def __init__(self, seeds, denom=1):
+    "See help(type(self))"
+    if not HAVE_NUMPY:
+      raise ImportError("NoitaRNGArray requires numpy")
+    self._seeds = numpy.array(seeds, dtype=numpy.int64)
+    if self._seeds.ndim != 1:
+      raise ValueError("seeds must be a one-dimensional sequence")
+    self._values = self._seeds.copy()
+    self._denom = denom
+    self._div = RAND_DIV * denom
+    self._mod = RAND_MOD * denom
+    self._max = RAND_MAX * denom
+
+  def __len__(self):
+    "Number of seeds being advanced"
+    return len(self._seeds)
+
+  @property
+  def seeds(self):
+    "Obtain the initial seeds"
+    return self._seeds.copy()
+
+  @property
+  def values(self):
+    "Obtain the current values"
+    return self._values.copy()
+
+  @property
+  def denom(self):
+    "Obtain the fixed-point denominator"
+    return self._denom
+
+  def next(self):
+    "Advance every value by one iteration and return the new values"
+    x_div, x_mod = numpy.divmod(self._values, self._div)
+    next_values = x_mod * RAND_COEFF - x_div * self._mod
+    next_values[next_values <= 0] += self._max
+    self._values = next_values
+    return next_values.copy()
+
+  def next_n(self, count):
+    "Advance count times; returns an array of shape (count, len(self))"
+    values = numpy.empty((count, len(self._seeds)), dtype=numpy.int64)
+    for idx in range(count):
+      values[idx] = self.next()
+    return values
+
+  def skip(self, count):
+    "Advance every value by count iterations in O(log count) time"
+    if count > 0 and self._denom == 1:
+      # Both factors are below 2^31, so the product fits in an int64
+      next_values = self._values * pow(RAND_COEFF, count, RAND_MAX) % RAND_MAX
+      next_values[next_values <= 0] += RAND_MAX
+      self._values = next_values
+    elif count > 0:
+      # The product would overflow an int64; use Python integers instead
+      mult = pow(RAND_COEFF, count, self._max)
+      next_values = [value * mult % self._max or self._max
+          for value in self._values.tolist()]
+      self._values = numpy.array(next_values, dtype=numpy.int64)
+    return self._values.copy()
+
+  def select(self, num_items):
+    "Choose a random number between 0 and num_items-1 inclusive per seed"
+    whole, frac = numpy.divmod(self.next(), self._denom)
+    # floor(n*v / (denom*2^31)) == floor(floor(n*v / denom) / 2^31), and
+    # computing it this way avoids overflowing an int64
+    return (whole * num_items + frac * num_items // self._denom) // RAND_SCALE
+
 def make_chooser(sequence):
   "Create a mapping sufficient for choose()"
   return {idx: [key, False] for idx, key in enumerate(sequence)}
 
 def main():
   ap = argparse.ArgumentParser()
-  ap.add_argument("seed", type=int, help="world seed")
+  ap.add_argument("seed", type=int, nargs="?",
+      help="world seed (required unless --show-trace is given)")
   ag = ap.add_argument_group("iteration control")
   ag.add_argument("-S", "--skip", type=int, metavar="NUM", default=0,
       help="advance %(metavar)s iterations prior to generation")
@@ -106,17 +459,35 @@ def main():
       help="pick random thing(s) from %(metavar)s")
   ag.add_argument("-u", "--unique", action="store_true",
       help="disallow duplicate choices")
+  ag = ap.add_argument_group("tracing")
+  ag.add_argument("--trace", metavar="PATH",
+      help="record every draw and write the trace to %(metavar)s")
+  ag.add_argument("--show-trace", metavar="PATH",
+      help="display the draws recorded in %(metavar)s and exit")
   ap.add_argument("-v", "--verbose", action="store_true", help="verbose output")
   args = ap.parse_args()
   if args.verbose:
     logger.setLevel(logging.DEBUG)
 
+  if args.show_trace:
+    trace = RNGTrace.load(args.show_trace)
+    for seed, step, value, consumer, denom in trace.records():
+      if denom != 1:
+        seed = decimal.Decimal(seed) / denom
+        value = decimal.Decimal(value) / denom
+      print(f"{seed} {step} {value} {consumer}")
+    ap.exit()
+  if args.seed is None:
+    ap.error("the following arguments are required: seed")
+
+  if args.trace:
+    enable_trace()
+
   # Rescale the seed the way Noita does it
-  seed = int(args.seed * SEED_SCALE + SEED_OFFSET)
+  seed = scale_seed(args.seed) // SEED_DENOM
   rng = NoitaRNG(seed)
 
-  for _ in range(args.skip):
-    rng.next()
+  rng.skip(args.skip)
 
   if args.choose is not None:
     entries = [line for line in args.choose.read().splitlines() if line]
@@ -126,10 +497,14 @@ def main():
       value = rng.choose(chooser, unique=args.unique)
       print(f"{idx} {value}")
   else:
-    for idx in range(args.num):
-      value = rng.next()
+    for idx, value in enumerate(rng.next_n(args.num)):
       print(f"{idx} {value}")
 
+  if args.trace:
+    trace = disable_trace()
+    trace.dump(args.trace)
+    logger.info("Wrote %d draws to %s", len(trace), args.trace)
+
 if __name__ == "__main__":
   main()
 
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+"""
+Write report records as JSON or newline-delimited JSON
+
+A ReportWriter serializes each record straight to its stream as it is
+written, tagging it with a "type" field naming the kind of record:
+
+  with ReportWriter(sys.stdout, FORMAT_NDJSON) as report:
+    report.write("session", {"seed": 1234, ...})
+
+FORMAT_NDJSON writes one JSON object per line. FORMAT_JSON writes a
+single JSON array of the same objects. Dates are written in ISO 8601
+format, enumerations by their lower-case name, other iterables as arrays,
+and NaN and infinite values as null.
+
+open_output() opens a large buffered text stream for a report, either on
+stdout or on a file, optionally compressed with gzip:
+
+  with open_output("sessions.ndjson.gz") as stream:
+    with ReportWriter(stream) as report:
+      ...
+"""
+
+import contextlib
+import datetime
+import enum
+import gzip
+import io
+import json
+import math
+import sys
+
+FORMAT_TEXT = "text"
+FORMAT_JSON = "json"
+FORMAT_NDJSON = "ndjson"
+FORMATS = (FORMAT_TEXT, FORMAT_JSON, FORMAT_NDJSON)
+
+OUTPUT_BUFFER_SIZE = 256 * 1024
+GZIP_EXT = ".gz"
+
+def _finite(value):
+  "Replace NaN and infinite floats within value by None"
+  if isinstance(value, float):
+    return value if math.isfinite(value) else None
+  if isinstance(value, dict):
+    return {key: _finite(item) for key, item in value.items()}
+  if isinstance(value, (list, tuple)):
+    return [_finite(item) for item in value]
+  return value
+
+class RecordEncoder(json.JSONEncoder):
+  """
+  JSON encoder that also handles dates, enumerations and iterables, and
+  writes NaN and infinite values as null so that the output is valid JSON
+  """
+  def encode(self, o):
+    "See help(json.JSONEncoder.encode)"
+    return super().encode(_finite(o))
+
+  def default(self, o): # pylint: disable=method-hidden
+    "See help(json.JSONEncoder.default)"
+    if isinstance(o, (datetime.date, datetime.time)):
+      return o.isoformat()
+    if isinstance(o, enum.Enum):
+      return o.name.lower()
+    try:
+      return _finite(list(iter(o)))
+    except TypeError:
+      return super().default(o)
+
+class ReportWriter:
+  "Serialize report records to a stream"
+  def __init__(self, stream, fmt=FORMAT_NDJSON):
+    "See help(type(self))"
+    if fmt not in (FORMAT_JSON, FORMAT_NDJSON):
+      raise ValueError(f"Invalid record format {fmt!r}")
+    self._stream = stream
+    self._format = fmt
+    self._encoder = RecordEncoder(ensure_ascii=False, allow_nan=False)
+    self._count = 0
+    self._closed = False
+
+  def __enter__(self):
+    "Context manager entry"
+    return self
+
+  def __exit__(self, *args):
+    "Context manager exit"
+    self.close()
+
+  @property
+  def count(self):
+    "Number of records written"
+    return self._count
+
+  def write(self, kind, record):
+    "Write a single record of the given kind"
+    data = {"type": kind}
+    data.update(record)
+    if self._format == FORMAT_NDJSON:
+      self._stream.write(self._encoder.encode(data))
+      self._stream.write("\n")
+    else:
+      self._stream.write(",\n" if self._count else "[\n")
+      self._stream.write(self._encoder.encode(data))
+    self._count += 1
+
+  def close(self):
+    "Finish the output; the stream itself is left open"
+    if self._closed:
+      return
+    if self._format == FORMAT_JSON:
+      self._stream.write("\n]\n" if self._count else "[]\n")
+    self._stream.flush()
+    self._closed = True
+
+def _open_stdout():
+  "Open the file underlying sys.stdout for writing binary data"
+  sys.stdout.flush()
+  return io.FileIO(sys.stdout.fileno(), "wb", closefd=False)
+
+@contextlib.contextmanager
+def open_output(path=None, compress=None, buffer_size=OUTPUT_BUFFER_SIZE):
+  """
+  Open a buffered text stream writing to path, or to stdout if path is
+  None or "-". Output is compressed with gzip if compress is True, or if
+  compress is None and path ends with GZIP_EXT.
+
+  Uncompressed output to a terminal is line-buffered so that it appears
+  as it is written. The stream is flushed (and the file closed) on exit.
+  """
+  if path == "-":
+    path = None
+  if compress is None:
+    compress = path is not None and path.endswith(GZIP_EXT)
+  if path is None:
+    try:
+      raw = _open_stdout()
+    except (AttributeError, io.UnsupportedOperation):
+      # stdout was replaced by something without a file descriptor
+      yield sys.stdout
+      return
+    encoding = sys.stdout.encoding
+  else:
+    raw = io.FileIO(path, "wb")
+    encoding = "utf-8"
+  with contextlib.ExitStack() as stack:
+    stack.callback(raw.close)
+    binary = io.BufferedWriter(raw, buffer_size)
+    stack.callback(binary.close)
+    if compress:
+      binary = gzip.GzipFile(fileobj=binary, mode="wb")
+      stack.callback(binary.close)
+    stream = io.TextIOWrapper(binary, encoding=encoding,
+        line_buffering=not compress and raw.isatty())
+    # Flush the stream and leave closing to the callbacks above
+    stack.callback(stream.detach)
+    yield stream
+
+# vim: set ts=2 sts=2 sw=2:
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+"""
+Watch directories for files being written
+
+open_watcher() returns an InotifyWatcher on Linux and a PollingWatcher
+everywhere else (or if inotify is unavailable). Both report the paths of
+files created, replaced, or written to within the watched directories:
+
+  with open_watcher([path1, path2]) as watcher:
+    while True:
+      for fpath in watcher.wait():
+        ...
+
+Directories are watched rather than files so that files replaced by
+renaming a temporary file over them are still reported.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+
+from . import loghelper
+logger = loghelper.DelayLogger(__name__)
+
+POLL_INTERVAL = 1.0 # Seconds between directory scans when polling
+SETTLE_TIME = 0.25 # Seconds to wait for related changes to arrive
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct("iIII") # wd, mask, cookie, len
+READ_SIZE = 64 * 1024
+
+def _load_libc():
+  "Load the C library if it provides inotify; returns None otherwise"
+  try:
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    libc.inotify_init1.argtypes = (ctypes.c_int,)
+    libc.inotify_add_watch.argtypes = (
+        ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+  except (OSError, AttributeError):
+    return None
+  return libc
+
+class _Watcher:
+  "Base class providing context manager support"
+  def __enter__(self):
+    "Context manager entry"
+    return self
+
+  def __exit__(self, *args):
+    "Context manager exit"
+    self.close()
+
+  def close(self):
+    "Stop watching"
+
+class InotifyWatcher(_Watcher):
+  "Watch directories using the Linux inotify API"
+  def __init__(self, directories, libc=None):
+    "See help(type(self))"
+    self._libc = libc or _load_libc()
+    if self._libc is None:
+      raise OSError(errno.ENOSYS, "inotify is not available")
+    self._fd = self._libc.inotify_init1(IN_CLOEXEC)
+    if self._fd < 0:
+      err = ctypes.get_errno()
+      raise OSError(err, os.strerror(err))
+    self._dirs = {}
+    try:
+      for dir_path in directories:
+        wd = self._libc.inotify_add_watch(self._fd,
+            os.fsencode(dir_path), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+          err = ctypes.get_errno()
+          raise OSError(err, os.strerror(err), dir_path)
+        self._dirs[wd] = dir_path
+    except OSError:
+      self.close()
+      raise
+
+  def close(self):
+    "Stop watching"
+    if self._fd >= 0:
+      os.close(self._fd)
+      self._fd = -1
+
+  def _read_events(self, timeout):
+    "Read pending events, waiting up to timeout seconds for the first"
+    ready, _, _ = select.select([self._fd], [], [], timeout)
+    if not ready:
+      return set()
+    data = os.read(self._fd, READ_SIZE)
+    paths = set()
+    offset = 0
+    while offset < len(data):
+      wd, mask, _, name_len = INOTIFY_EVENT.unpack_from(data, offset)
+      offset += INOTIFY_EVENT.size
+      name = data[offset:offset+name_len].rstrip(b"\0")
+      offset += name_len
+      if mask & IN_Q_OVERFLOW:
+        logger.warning("inotify queue overflowed; some changes were lost")
+      elif mask & IN_IGNORED:
+        logger.warning("No longer watching %s", self._dirs.pop(wd, wd))
+      elif wd in self._dirs and name:
+        paths.add(os.path.join(self._dirs[wd], os.fsdecode(name)))
+    return paths
+
+  def wait(self, timeout=None):
+    """
+    Wait up to timeout seconds (forever if None) for files to change and
+    return the set of paths that changed
+    """
+    paths = self._read_events(timeout)
+    while paths:
+      more = self._read_events(SETTLE_TIME)
+      if not more:
+        break
+      paths.update(more)
+    return paths
+
+class PollingWatcher(_Watcher):
+  "Watch directories by periodically comparing their contents"
+  def __init__(self, directories, interval=POLL_INTERVAL):
+    "See help(type(self))"
+    self._dirs = list(directories)
+    self._interval = interval
+    self._state = self._scan()
+
+  def _scan(self):
+    "Get the (mtime, size) of every file in the watched directories"
+    state = {}
+    for dir_path in self._dirs:
+      try:
+        with os.scandir(dir_path) as entries:
+          for entry in entries:
+            if entry.is_file():
+              fstat = entry.stat()
+              state[entry.path] = (fstat.st_mtime_ns, fstat.st_size)
+      except FileNotFoundError:
+        pass
+    return state
+
+  def wait(self, timeout=None):
+    """
+    Wait up to timeout seconds (forever if None) for files to change and
+    return the set of paths that changed
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+      state = self._scan()
+      paths = {path for path, info in state.items()
+          if self._state.get(path) != info}
+      self._state = state
+      if paths:
+        return paths
+      delay = self._interval
+      if deadline is not None:
+        delay = min(delay, deadline - time.monotonic())
+        if delay <= 0:
+          return set()
+      time.sleep(delay)
+
+def open_watcher(directories, interval=POLL_INTERVAL):
+  """
+  Watch the given directories using inotify if possible, falling back to
+  polling every interval seconds
+  """
+  directories = list(directories)
+  libc = _load_libc()
+  if libc is not None:
+    try:
+      return InotifyWatcher(directories, libc)
+    except OSError as err:
+      logger.debug("inotify unavailable (%s); polling instead", err)
+  return PollingWatcher(directories, interval)
+
+# vim: set ts=2 sts=2 sw=2: